@@ -1,9 +1,58 @@
-from flask import Flask, render_template, redirect, url_for, request, session
+from flask import Flask, before_render_template, template_rendered, has_app_context, has_request_context, render_template, stream_template, stream_with_context, redirect, url_for, request, session, g, jsonify, abort, send_from_directory
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.routing import IntegerConverter
+from markupsafe import Markup, escape
+from collections import OrderedDict, deque, namedtuple
+from logging.handlers import RotatingFileHandler
+import asyncio
+import base64
+import click
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import mimetypes
+import os
+import queue
+import re
 import sqlite3
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+
+try:
+    import orjson
+except ImportError:  # optional: faster, more compact JSON for the API
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: .br copies of static assets
+    brotli = None
+
+DB_PATH = os.environ.get("BOOKS_DB_PATH", "db.sqlite3")
+SQLITE_MAX_INT = 2**63 - 1  # larger Python ints cannot be bound as parameters
+
+
+class SQLiteIntConverter(IntegerConverter):
+    """<int:...> URL converter that only matches values SQLite can store (404 otherwise)."""
+
+    def __init__(self, map, *args, **kwargs):
+        kwargs.setdefault('max', SQLITE_MAX_INT)
+        super().__init__(map, *args, **kwargs)
 
-DB_PATH = "db.sqlite3"
 
 app = Flask(__name__)
+app.url_map.converters['int'] = SQLiteIntConverter
 app.secret_key = "The quick brown fox jumps over the fence."  # required for sessions
 
 # ---------------- Template loader ----------------
@@ -29,10 +78,43 @@ AVAILABLE_TEMPLATES = [
 # Set the template module you want to use
 TEMPLATE_MODULE = "tailwind"  # change this to any in AVAILABLE_TEMPLATES
 
+# List page mode: True = DataTables fetches one page at a time from /books.json,
+# False = every row is rendered into list.html and DataTables pages client-side
+SERVER_SIDE_LIST = True
+MAX_PAGE_LENGTH = 100  # largest page /books.json will return
+# Client-side mode only: send list.html while rows are read from the cursor,
+# instead of building the whole page in memory first (streamed pages skip the page cache)
+STREAM_LIST = True
+
 # Ensure it is valid
 if TEMPLATE_MODULE not in AVAILABLE_TEMPLATES:
     raise ValueError(f"Invalid TEMPLATE_MODULE '{TEMPLATE_MODULE}'. Must be one of {AVAILABLE_TEMPLATES}")
 
+# Compiled templates are kept as bytecode files shared by every worker on the
+# host, so after a deploy each template is compiled once rather than once per worker.
+# Entries are keyed by a checksum of the source, so edited templates are recompiled.
+# Bytecode is executed when loaded, so the directory must only be writable by the
+# app's user: None uses Jinja's private per-user directory (mode 0700, owner
+# checked); set a path only for a directory the deploy user owns.
+TEMPLATE_CACHE_DIR = None
+PRECOMPILE_TEMPLATES = True  # load every theme's templates at startup
+
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+# Load (compiling or reading bytecode) every template of the given themes.
+# Returns {theme: (templates loaded, seconds)}.
+def precompile_templates(themes=AVAILABLE_TEMPLATES):
+    env = app.jinja_env
+    names = env.list_templates(extensions=["html"])
+    timings = {}
+    for theme in themes:
+        start = time.perf_counter()
+        loaded = [env.get_template(n) for n in names if n.startswith(f"{theme}/")]
+        timings[theme] = (len(loaded), time.perf_counter() - start)
+    return timings
+
+
 # Function to get template path
 def template_path(name):
     """
@@ -56,62 +138,1394 @@ def set_theme():
 def inject_template_path():
     return dict(
         template_path=template_path,
+        asset_url=asset_url,
+        stylesheet=stylesheet,
+        critical_css=critical_css,
         AVAILABLE_TEMPLATES=AVAILABLE_TEMPLATES
     )
 
+# ---------------- Static assets ----------------
+
+# Third-party files used by the themes, pinned so builds are reproducible.
+# `flask assets build` downloads them into ASSET_DIR under content-hashed names,
+# with .gz (and .br) copies, and records the names in the manifest. Until then
+# asset_url() returns the CDN address.
+ASSETS = {
+    "jquery.js": "https://code.jquery.com/jquery-3.7.1.min.js",
+    "datatables.js": "https://cdn.datatables.net/1.13.6/js/jquery.dataTables.min.js",
+    "datatables.css": "https://cdn.datatables.net/1.13.6/css/jquery.dataTables.min.css",
+    "datatables-bootstrap5.js": "https://cdn.datatables.net/1.13.6/js/dataTables.bootstrap5.min.js",
+    "datatables-bootstrap5.css": "https://cdn.datatables.net/1.13.6/css/dataTables.bootstrap5.min.css",
+    "bootstrap.css": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css",
+    "bootstrap.js": "https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js",
+    "bulma.css": "https://cdn.jsdelivr.net/npm/bulma@0.9.4/css/bulma.min.css",
+    "foundation.css": "https://cdn.jsdelivr.net/npm/foundation-sites@6.8.7/dist/css/foundation.min.css",
+    "foundation.js": "https://cdn.jsdelivr.net/npm/foundation-sites@6.8.7/dist/js/foundation.min.js",
+    "materialize.css": "https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/css/materialize.min.css",
+    "materialize.js": "https://cdnjs.cloudflare.com/ajax/libs/materialize/1.0.0/js/materialize.min.js",
+    "metro.css": "https://cdn.jsdelivr.net/npm/metro4@4.5.1/build/css/metro-all.min.css",
+    "metro.js": "https://cdn.jsdelivr.net/npm/metro4@4.5.1/build/js/metro.min.js",
+    "milligram.css": "https://cdnjs.cloudflare.com/ajax/libs/milligram/1.4.1/milligram.min.css",
+    "mini.css": "https://cdn.jsdelivr.net/npm/mini.css@3.0.1/dist/mini-default.min.css",
+    "paper.css": "https://unpkg.com/papercss@1.8.1/dist/paper.min.css",
+    "pico.css": "https://unpkg.com/@picocss/pico@1.5.13/css/pico.min.css",
+    "pure.css": "https://unpkg.com/purecss@2.1.0/build/pure-min.css",
+    "semantic.css": "https://cdn.jsdelivr.net/npm/fomantic-ui@2.9.0/dist/semantic.min.css",
+    "semantic.js": "https://cdn.jsdelivr.net/npm/fomantic-ui@2.9.0/dist/semantic.min.js",
+    "skeleton.css": "https://cdnjs.cloudflare.com/ajax/libs/skeleton/2.0.4/skeleton.min.css",
+    "tailwind.js": "https://cdn.tailwindcss.com/3.4.1",
+    "uikit.css": "https://cdn.jsdelivr.net/npm/uikit@3.21.1/dist/css/uikit.min.css",
+    "uikit.js": "https://cdn.jsdelivr.net/npm/uikit@3.21.1/dist/js/uikit.min.js",
+    "uikit-icons.js": "https://cdn.jsdelivr.net/npm/uikit@3.21.1/dist/js/uikit-icons.min.js",
+}
+
+ASSET_DIR = os.path.join(app.root_path, "static", "assets")
+ASSET_MANIFEST = os.path.join(ASSET_DIR, "manifest.json")
+# Expected sha256 of every downloaded file, by URL. Kept in the repository, so a
+# CDN serving different bytes for a pinned version fails the build.
+ASSET_PINS = os.path.join(app.root_path, "asset-pins.json")
+ASSET_MAX_AGE = 31536000  # one year; the names change whenever the content does
+ASSET_COMPRESSIBLE = {".css", ".js", ".svg", ".ttf", ".eot", ".json", ".map"}
+
+# url(...) references in a stylesheet, e.g. fonts and images next to it
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+asset_manifest = load_asset_manifest()
+
+
+def load_asset_pins():
+    try:
+        with open(ASSET_PINS) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# URL of a built asset, or its CDN address when `flask assets build` has not run
+def asset_url(name):
+    filename = asset_manifest.get(name)
+    if filename is None:
+        return ASSETS[name]
+    return url_for('asset', filename=filename)
+
+
+# Write data under a content-hashed name (stem.<hash>.ext) plus compressed copies.
+# Returns the file name.
+def store_asset(name, data):
+    stem, ext = os.path.splitext(name)
+    filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+    path = os.path.join(ASSET_DIR, filename)
+    with open(path, "wb") as f:
+        f.write(data)
+    if ext in ASSET_COMPRESSIBLE:
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+    return filename
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+# Download a file and check it against its pin. With update=True a missing or
+# different pin is recorded in `pins` instead of failing.
+def fetch_pinned(url, pins, update=False):
+    data = fetch(url)
+    digest = hashlib.sha256(data).hexdigest()
+    expected = pins.get(url)
+    if expected != digest:
+        if not update:
+            if expected is None:
+                raise ValueError(f"{url} has no pinned sha256 in {os.path.basename(ASSET_PINS)}")
+            raise ValueError(f"{url} has sha256 {digest}, pinned {expected}")
+        pins[url] = digest
+    return data
+
+
+# Download one asset. Relative url(...) references in stylesheets are fetched
+# too, stored under their own hashed names and rewritten to point at them.
+# Every file is checked against `pins` (see fetch_pinned).
+def build_asset(name, url, pins, update_pins=False):
+    data = fetch_pinned(url, pins, update_pins)
+    if name.endswith(".css"):
+        stored = {}
+
+        def rewrite(match):
+            quote, ref = match.groups()
+            if ref.startswith(("data:", "http:", "https:", "//", "#")):
+                return match.group(0)
+            target = urllib.parse.urljoin(url, ref)
+            parts = urllib.parse.urlsplit(target)
+            fragment = f"#{parts.fragment}" if parts.fragment else ""
+            source = urllib.parse.urlunsplit(parts._replace(query="", fragment=""))
+            if source not in stored:
+                stored[source] = store_asset(os.path.basename(parts.path),
+                                             fetch_pinned(source, pins, update_pins))
+            return f"url({quote}{stored[source]}{fragment}{quote})"
+
+        data = CSS_URL.sub(rewrite, data.decode("utf-8")).encode("utf-8")
+    return store_asset(name, data)
+
+
+# ---------------- Critical CSS ----------------
+
+# `flask assets critical` keeps, for each theme, the rules of its stylesheets whose
+# selectors can match its templates. base.html inlines them and loads the full
+# stylesheets without blocking the first paint.
+CRITICAL_DIR = os.path.join(ASSET_DIR, "critical")
+
+# Classes DataTables adds at runtime, so they never appear in the templates
+DATATABLES_CLASSES = {
+    "dataTable", "dataTables_wrapper", "dataTables_length", "dataTables_filter",
+    "dataTables_info", "dataTables_paginate", "dataTables_processing", "dataTables_empty",
+    "paginate_button", "previous", "next", "current", "disabled", "ellipsis",
+    "sorting", "sorting_asc", "sorting_desc", "sorting_disabled", "odd", "even",
+    "no-footer", "row", "col-sm-12", "col-md-5", "col-md-6", "col-md-7",
+    "pagination", "page-item", "page-link", "active", "form-select", "form-select-sm",
+    "form-control", "form-control-sm",
+}
+
+# Selectors that are always kept
+CRITICAL_ALWAYS = {"*", "html", "body", ":root"}
+
+HTML_TAG = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+HTML_CLASS = re.compile(r"""class\s*=\s*["']([^"']*)["']""")
+HTML_ID = re.compile(r"""id\s*=\s*["']([^"'{}]*)["']""")
+JINJA_TAG = re.compile(r"\{[{%#].*?[}%#]\}", re.S)
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+# Parts of a selector that do not decide whether it can match: pseudo-classes,
+# pseudo-elements and attribute selectors
+CSS_IGNORED = re.compile(r"::?[a-zA-Z-]+(\([^)]*\))?|\[[^\]]*\]")
+CSS_NAME = re.compile(r"([.#]?)(-?[_a-zA-Z][-_a-zA-Z0-9]*|\*)")
+
+
+# Tags, classes and ids used by a theme's templates
+def theme_vocabulary(theme):
+    tags, classes, ids = set(), set(DATATABLES_CLASSES), set()
+    folder = os.path.join(app.root_path, "templates", theme)
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name)) as f:
+            html = f.read()
+        tags.update(t.lower() for t in HTML_TAG.findall(html))
+        for value in HTML_CLASS.findall(html):
+            classes.update(JINJA_TAG.sub(" ", value).split())
+        ids.update(v.strip() for v in HTML_ID.findall(html))
+    return tags, classes, ids
+
+
+# Whether any selector of a comma-separated list can match the vocabulary
+def selector_used(selectors, tags, classes, ids):
+    for selector in selectors.split(","):
+        names = CSS_NAME.findall(CSS_IGNORED.sub(" ", selector))
+        if not names and selector.strip() in CRITICAL_ALWAYS:
+            return True
+        if names and all(
+            (kind == "." and name in classes) or
+            (kind == "#" and name in ids) or
+            (kind == "" and (name == "*" or name.lower() in tags or name.lower() in CRITICAL_ALWAYS))
+            for kind, name in names
+        ):
+            return True
+    return False
+
+
+# Index of the first of `chars` at or after `start` that is not inside a quoted
+# string or escaped (a[href^="{"], .a\{), or -1
+def find_unquoted(css, chars, start):
+    i, quote = start, None
+    while i < len(css):
+        c = css[i]
+        if c == "\\":
+            i += 1
+        elif quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c in chars:
+            return i
+        i += 1
+    return -1
+
+
+# Index just past the block that starts at css[start] == "{"
+def block_end(css, start):
+    depth, i, quote = 0, start, None
+    while i < len(css):
+        c = css[i]
+        if c == "\\":
+            i += 1
+        elif quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(css)
+
+
+# The rules of a stylesheet that can apply to the vocabulary; @media and
+# @supports blocks are filtered recursively, @font-face is kept, other at-rules dropped
+def critical_rules(css, vocabulary):
+    css = CSS_COMMENT.sub("", css)
+    out, i = [], 0
+    while i < len(css):
+        # Quote-aware, like block_end, so a "{" in an attribute selector's value
+        # does not start the block
+        brace = find_unquoted(css, "{;", i)
+        if brace == -1:
+            break
+        if css[brace] == ";":
+            if css[i:brace].lstrip().startswith("@"):
+                i = brace + 1  # @charset, @import: not needed inline
+                continue
+            brace = find_unquoted(css, "{", brace + 1)
+            if brace == -1:
+                break
+        prelude = css[i:brace].strip()
+        end = block_end(css, brace)
+        body = css[brace + 1:end - 1]
+        if prelude.startswith(("@media", "@supports")):
+            inner = critical_rules(body, vocabulary)
+            if inner:
+                out.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith("@font-face"):
+            out.append(f"{prelude}{{{body}}}")
+        elif not prelude.startswith("@") and selector_used(prelude, *vocabulary):
+            out.append(f"{prelude}{{{body}}}")
+        i = end
+    return "".join(out)
+
+
+# Stylesheet names a theme's base.html loads through stylesheet()
+def theme_stylesheets(theme):
+    with open(os.path.join(app.root_path, "templates", theme, "base.html")) as f:
+        return re.findall(r"stylesheet\('([^']+)'\)", f.read())
+
+
+# Build the critical CSS of one theme from its built stylesheets.
+# Relative url()s are made absolute, since the CSS moves into the page.
+def build_critical_css(theme, manifest, asset_prefix):
+    vocabulary = theme_vocabulary(theme)
+    parts = []
+    for name in theme_stylesheets(theme):
+        filename = manifest.get(name)
+        if filename is None:
+            continue
+        with open(os.path.join(ASSET_DIR, filename), encoding="utf-8") as f:
+            css = f.read()
+
+        def absolute(match):
+            quote, ref = match.groups()
+            if ref.startswith(("data:", "http:", "https:", "/", "#")):
+                return match.group(0)
+            return f"url({quote}{asset_prefix}{ref}{quote})"
+
+        parts.append(CSS_URL.sub(absolute, critical_rules(css, vocabulary)))
+    return "".join(parts)
+
+
+def load_critical_css():
+    styles = {}
+    for theme in AVAILABLE_TEMPLATES:
+        try:
+            with open(os.path.join(CRITICAL_DIR, f"{theme}.css"), encoding="utf-8") as f:
+                styles[theme] = f.read()
+        except OSError:
+            pass
+    return styles
+
+
+critical_styles = load_critical_css()
+
+
+# <style> with the current theme's critical CSS, if it has been built
+def critical_css():
+    css = critical_styles.get(session.get('theme', TEMPLATE_MODULE))
+    if not css:
+        return ""
+    return Markup("<style>" + css.replace("</", "<\\/") + "</style>")
+
+
+# <link> for a stylesheet asset; loaded without blocking rendering when the
+# current theme's critical CSS is inlined
+def stylesheet(name):
+    href = escape(asset_url(name))
+    if not critical_styles.get(session.get('theme', TEMPLATE_MODULE)):
+        return Markup(f'<link rel="stylesheet" href="{href}">')
+    return Markup(
+        f'<link rel="preload" as="style" href="{href}" onload="this.onload=null;this.rel=\'stylesheet\'">'
+        f'<noscript><link rel="stylesheet" href="{href}"></noscript>'
+    )
+
+
+# Serve a built asset, precompressed when the client accepts it
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[candidate] > 0 and \
+                os.path.isfile(os.path.join(ASSET_DIR, filename + suffix)):
+            encoding = candidate
+            filename += suffix
+            break
+    response = send_from_directory(ASSET_DIR, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+# ---------------- Metrics ----------------
+
+# Per-request timings (total, SQL, template rendering) and query counts, kept in
+# histograms by route and theme, served at /metrics in the Prometheus text format
+# and sent to the browser as a Server-Timing header. Streamed responses are
+# measured up to the moment the body starts streaming.
+METRICS = True
+SERVER_TIMING = True
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label set."""
+
+    def __init__(self, name, help, buckets, labels=("route", "theme")):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+HISTOGRAMS = {
+    "total": Histogram("books_request_duration_seconds", "Time to handle a request.", LATENCY_BUCKETS),
+    "sql": Histogram("books_sql_duration_seconds", "Time spent in SQLite per request.", LATENCY_BUCKETS),
+    "template": Histogram("books_template_duration_seconds", "Time spent rendering templates per request.", LATENCY_BUCKETS),
+    "queries": Histogram("books_sql_queries", "SQL statements executed per request.", QUERY_COUNT_BUCKETS),
+}
+
+
+# Add one statement's time to the current request, if there is one
+def record_sql(seconds):
+    if has_app_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + seconds
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that adds the time spent executing and fetching to the request's SQL
+    time, and reports its statement to the slow-query log once that time,
+    summed over execute and every fetch, reaches SLOW_QUERY_THRESHOLD.
+    """
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            record_sql(elapsed)
+            self._track(elapsed, (sql, params, False))
+
+    def executemany(self, sql, params):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            record_sql(elapsed)
+            self._track(elapsed, (sql, params, True))
+
+    def _track(self, seconds, statement=None):
+        if statement is not None:
+            self._statement, self._elapsed, self._logged = statement, 0.0, False
+        elif not hasattr(self, "_statement"):
+            return
+        self._elapsed += seconds
+        if SLOW_QUERY_LOG and not self._logged and self._elapsed >= SLOW_QUERY_THRESHOLD:
+            self._logged = True
+            log_slow_query(self.connection, *self._statement, self._elapsed)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            if has_app_context():
+                g.sql_time = g.get('sql_time', 0.0) + elapsed
+            self._track(elapsed)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed_fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including those of execute()) are InstrumentedCursors."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        g.template_time = g.get('template_time', 0.0) + time.perf_counter() - started
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None or not (METRICS or SERVER_TIMING):
+        return response
+    total = time.perf_counter() - started
+    sql_time, sql_count = g.get('sql_time', 0.0), g.get('sql_count', 0)
+    template_time = g.get('template_time', 0.0)
+    if METRICS:
+        # Touching the session adds Vary: Cookie, which must stay off the
+        # immutable assets, so they are labelled "-" rather than by theme
+        theme = "-" if request.endpoint == 'asset' else session.get('theme', TEMPLATE_MODULE)
+        labels = (request.endpoint or "unknown", theme)
+        HISTOGRAMS["total"].observe(total, *labels)
+        HISTOGRAMS["sql"].observe(sql_time, *labels)
+        HISTOGRAMS["template"].observe(template_time, *labels)
+        HISTOGRAMS["queries"].observe(sql_count, *labels)
+    if SERVER_TIMING:
+        response.headers.add(
+            "Server-Timing",
+            f'sql;dur={sql_time * 1000:.2f};desc="{sql_count} queries", '
+            f"tpl;dur={template_time * 1000:.2f}, total;dur={total * 1000:.2f}"
+        )
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    body = "\n".join(h.exposition() for h in HISTOGRAMS.values()) + "\n"
+    return app.response_class(body, mimetype="text/plain; version=0.0.4")
+
+# ---------------- Slow query log ----------------
+
+# Statements that take SLOW_QUERY_THRESHOLD seconds or more on a pooled
+# connection are logged with their parameters (strings and blobs redacted to
+# their length), their EXPLAIN QUERY PLAN and the route that issued them. Entries
+# go to a rotating file as JSON lines and to a ring buffer at /debug/slow-queries.
+# A "SCAN b" step in the plan is a full table scan.
+SLOW_QUERY_LOG = True
+SLOW_QUERY_THRESHOLD = 0.05          # seconds
+SLOW_QUERY_REDACT = True             # False logs parameter values as they are
+SLOW_QUERY_FILE = "slow-queries.log"  # None = ring buffer only
+SLOW_QUERY_FILE_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_FILE_BACKUPS = 5
+SLOW_QUERY_BUFFER = 200              # entries kept for /debug/slow-queries
+
+slow_queries = deque(maxlen=SLOW_QUERY_BUFFER)
+slow_query_logger = logging.getLogger("books.slow_queries")
+slow_query_logger.setLevel(logging.INFO)
+slow_query_logger.propagate = False
+if SLOW_QUERY_FILE:
+    _handler = RotatingFileHandler(SLOW_QUERY_FILE, maxBytes=SLOW_QUERY_FILE_MAX_BYTES,
+                                   backupCount=SLOW_QUERY_FILE_BACKUPS, delay=True)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_query_logger.addHandler(_handler)
+
+# Route of statements run by the writer thread on behalf of a request
+_write_route = threading.local()
+
+
+# The request that is running the current statement: "endpoint GET /path",
+# or the writer thread's caller, or the thread name (CLI commands, benchmarks)
+def query_route():
+    if has_request_context():
+        return f"{request.endpoint} {request.method} {request.path}"
+    return getattr(_write_route, "value", None) or threading.current_thread().name
+
+
+def redact_params(params):
+    def redact(value):
+        if not SLOW_QUERY_REDACT or value is None or isinstance(value, (int, float)):
+            return value
+        if isinstance(value, (str, bytes)):
+            return f"<{type(value).__name__}:{len(value)}>"
+        return f"<{type(value).__name__}>"
+
+    if isinstance(params, dict):
+        return {k: redact(v) for k, v in params.items()}
+    return [redact(v) for v in params]
+
+
+# EXPLAIN QUERY PLAN of a statement, one line per step, indented like the sqlite3 shell
+def explain_plan(conn, sql, params):
+    try:
+        # A plain cursor, so explaining is not itself timed or logged
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error:
+        return []
+    depth, plan = {}, []
+    for step_id, parent, _, detail in rows:
+        depth[step_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[step_id] + detail)
+    return plan
+
+
+def log_slow_query(conn, sql, params, many, seconds):
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "duration_ms": round(seconds * 1000, 2),
+        "route": query_route(),
+        "sql": " ".join(sql.split()),
+        # executemany parameters are usually a generator that is already used up
+        "params": "<executemany>" if many else redact_params(params),
+        "plan": [] if many else explain_plan(conn, sql, params),
+    }
+    slow_queries.append(entry)
+    slow_query_logger.info(json.dumps(entry, default=str))
+
+
+@app.route('/debug/slow-queries')
+def slow_query_log():
+    return jsonify(
+        threshold_ms=SLOW_QUERY_THRESHOLD * 1000,
+        entries=list(reversed(slow_queries))
+    )
+
+
+# ---------------- Connection pool ----------------
+
+POOL_SIZE = 8           # idle connections kept per worker (0 = connect per request)
+POOL_RECYCLE = 3600     # seconds before a connection is closed and reopened
+POOL_PING_AFTER = 30    # idle seconds after which a connection is health-checked
+
+# PRAGMAs applied once, in order, when a connection is opened. WAL lets readers
+# keep going while a writer commits; busy_timeout makes a blocked writer wait for
+# the lock instead of failing with "database is locked". Override per pool with
+# ConnectionPool(path, pragmas={...}).
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": 5000,       # ms to wait for a lock
+    "synchronous": "NORMAL",    # safe with WAL; fsync on checkpoint, not every commit
+    "cache_size": -16000,       # 16 MB page cache, kept warm across requests
+    "mmap_size": 268435456,     # read through a 256 MB memory map
+    "temp_store": "MEMORY",
+}
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections shared by the threads of one worker.
+    At most `size` idle connections are kept; extra ones are closed on release.
+    A `readonly` pool opens connections with mode=ro and PRAGMA query_only.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, recycle=POOL_RECYCLE, ping_after=POOL_PING_AFTER,
+                 pragmas=None, readonly=False):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+        self.readonly = readonly
+        if readonly:
+            # The journal mode belongs to the database file and is set by the writer
+            self.pragmas.pop("journal_mode", None)
+            self.pragmas["query_only"] = "ON"
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = queue.LifoQueue(maxsize=max(size, 1))
+
+    def _connect(self):
+        factory = InstrumentedConnection if METRICS or SLOW_QUERY_LOG else sqlite3.Connection
+        if self.readonly:
+            uri = f"file:{urllib.parse.quote(self.path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=factory)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, factory=factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        now = time.monotonic()
+        return [conn, now, now]  # connection, opened at, last used
+
+    def acquire(self):
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            conn, opened, last_used = entry
+            now = time.monotonic()
+            if now - opened > self.recycle:
+                conn.close()
+                continue
+            if now - last_used > self.ping_after:
+                try:
+                    conn.execute("SELECT 1")
+                except sqlite3.Error:
+                    conn.close()
+                    continue
+            return entry
+
+    def release(self, entry):
+        conn = entry[0]
+        if self.size <= 0:
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        entry[2] = time.monotonic()
+        try:
+            self._idle.put_nowait(entry)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait()[0].close()
+            except queue.Empty:
+                return
+
+
+# Reads go through a pool of read-only connections. Writes use a separate pool
+# and are serialized by write_lock, held from the first write of a request until
+# its app context ends; with WAL, readers never wait for it. Other worker
+# processes are serialized by SQLite itself, within busy_timeout.
+READ_POOL_SIZE = POOL_SIZE
+WRITE_POOL_SIZE = 1
+
+read_pool = ConnectionPool(DB_PATH, size=READ_POOL_SIZE, readonly=True)
+write_pool = ConnectionPool(DB_PATH, size=WRITE_POOL_SIZE)
+write_lock = threading.Lock()
+
+
+# Replace both pools, e.g. to point the app at another database file
+def configure_db(path, size=READ_POOL_SIZE, pragmas=None):
+    global read_pool, write_pool
+    read_pool.close()
+    write_pool.close()
+    read_pool = ConnectionPool(path, size=size, pragmas=pragmas, readonly=True)
+    write_pool = ConnectionPool(path, size=min(size, WRITE_POOL_SIZE), pragmas=pragmas)
+
+
+# Check out one read-only connection per app context; it goes back to the pool on teardown
+def get_db():
+    if 'db' not in g:
+        g.db = read_pool.acquire()
+    return g.db[0]
+
+
+# Check out the writer connection for this app context, waiting for write_lock
+def get_write_db():
+    if 'write_db' not in g:
+        write_lock.acquire()
+        try:
+            g.write_db = write_pool.acquire()
+        except BaseException:
+            write_lock.release()
+            raise
+    return g.write_db[0]
+
+
+# The writer connection for one block only, so write_lock is not held for the
+# rest of the app context. Uses the context's own connection if it has one.
+@contextlib.contextmanager
+def write_connection():
+    if 'write_db' in g:
+        yield g.write_db[0]
+        return
+    with write_lock:
+        entry = write_pool.acquire()
+        try:
+            yield entry[0]
+        finally:
+            write_pool.release(entry)
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    entry = g.pop('db', None)
+    if entry is not None:
+        read_pool.release(entry)
+    entry = g.pop('write_db', None)
+    if entry is not None:
+        try:
+            write_pool.release(entry)
+        finally:
+            write_lock.release()
+
+# ---------------- Write queue ----------------
+
+# Single statements from the write helpers (insert_book, update_book, delete_book)
+# go through one background writer per worker. It waits up to GROUP_COMMIT_WINDOW
+# seconds for more to arrive, runs up to GROUP_COMMIT_MAX_BATCH of them in one
+# transaction, and commits once. Each statement runs in its own savepoint, so a
+# failing one is rolled back alone and only its caller sees the error.
+GROUP_COMMIT = True           # False = every write helper commits on its own
+GROUP_COMMIT_WINDOW = 0.002   # seconds to wait for more writes after the first
+GROUP_COMMIT_MAX_BATCH = 256  # writes per transaction
+GROUP_COMMIT_TIMEOUT = 30     # seconds a caller waits for its commit (None = forever)
+
+
+class WriteQueue:
+    """Background writer that batches statements from many threads into group commits."""
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.commits = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    # Queue one statement; the future resolves to (lastrowid, rowcount, seconds)
+    # after the commit. seconds is the statement's own time plus the batch's
+    # BEGIN and COMMIT, which the caller waited on too.
+    def submit(self, sql, params=()):
+        self._ensure_thread()
+        future = concurrent.futures.Future()
+        self._queue.put((sql, params, future, query_route()))
+        return future
+
+    # Started on first use, again in a forked worker, which inherits no threads,
+    # and again should the thread ever have died, keeping the writes it left queued
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            elif self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="books-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Never let the thread die with callers waiting on this batch
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch):
+        results = []
+        with write_lock:
+            entry = None
+            try:
+                # Opening a connection can fail too (I/O error, a lock held while
+                # setting journal_mode); that fails the batch like any other error
+                entry = write_pool.acquire()
+                conn = entry[0]
+                start = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                shared = time.perf_counter() - start
+                for sql, params, future, route in batch:
+                    _write_route.value = route
+                    conn.execute("SAVEPOINT write")
+                    start = time.perf_counter()
+                    try:
+                        cur = conn.execute(sql, params)
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO write")
+                        results.append((future, None, e))
+                    else:
+                        elapsed = time.perf_counter() - start
+                        results.append((future, [cur.lastrowid, cur.rowcount, elapsed], None))
+                    conn.execute("RELEASE write")
+                start = time.perf_counter()
+                conn.commit()
+                shared += time.perf_counter() - start
+            except BaseException as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                return
+            finally:
+                _write_route.value = None
+                if entry is not None:
+                    write_pool.release(entry)
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                result[2] += shared
+                future.set_result(tuple(result))
+            else:
+                future.set_exception(error)
+
+
+writer = WriteQueue()
+
+
+# Run one write statement and return (lastrowid, rowcount) once it is committed.
+# A context that already holds the writer connection (and write_lock) uses it directly.
+# Statements run by the writer thread are added to this request's SQL metrics here,
+# as that thread has no request of its own.
+def run_write(sql, params=()):
+    if GROUP_COMMIT and 'write_db' not in g:
+        lastrowid, rowcount, seconds = writer.submit(sql, params).result(GROUP_COMMIT_TIMEOUT)
+        record_sql(seconds)
+        return lastrowid, rowcount
+    conn = get_write_db()
+    cur = conn.execute(sql, params)
+    conn.commit()
+    return cur.lastrowid, cur.rowcount
+
+# ---------------- Schema ----------------
+
+# Change counters, bumped by triggers so every worker (and any other program
+# writing to the database) can tell when cached data is stale
+META_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS app_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('categories_version', 0)",
+    "INSERT OR IGNORE INTO app_meta (key, value) VALUES ('books_version', 0)",
+] + [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+        UPDATE app_meta SET value = value + 1 WHERE key = '{table}_version';
+    END
+    """
+    for table in ("categories", "books")
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+
+# Columns of books in the full-text index. summary stays fourth, as snippet()
+# refers to it by position; new columns are appended.
+SEARCH_COLUMNS = ("title", "hepburn", "author", "summary", "published_date", "release")
+_fts_columns = ", ".join(SEARCH_COLUMNS)
+_fts_old = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+_fts_new = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+
+# Full-text index over books, kept in sync with the books table by triggers.
+# It is an external-content table: only the index is stored, text is read from books.
+SEARCH_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        {_fts_columns},
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, {_fts_columns})
+        VALUES (new.id, {_fts_new});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, {_fts_columns})
+        VALUES ('delete', old.id, {_fts_old});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, {_fts_columns})
+        VALUES ('delete', old.id, {_fts_old});
+        INSERT INTO books_fts (rowid, {_fts_columns})
+        VALUES (new.id, {_fts_new});
+    END
+    """,
+]
+
+# Drop the search index and its triggers, to create them again with new columns
+DROP_SEARCH_SCHEMA = [
+    f"DROP TRIGGER IF EXISTS books_fts_{event}" for event in ("insert", "delete", "update")
+] + ["DROP TABLE IF EXISTS books_fts"]
+
+
+# Rebuild the full-text index from the books table
+def rebuild_search_index():
+    conn = get_write_db()
+    for statement in SEARCH_SCHEMA:
+        conn.execute(statement)
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+# Read a change counter from app_meta
+def get_meta(key):
+    cur = get_db().execute("SELECT value FROM app_meta WHERE key = ?", (key,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+# Version of everything a page can show: books and their category names
+def data_version():
+    cur = get_db().execute(
+        "SELECT group_concat(value, '.') FROM app_meta "
+        "WHERE key IN ('books_version', 'categories_version')"
+    )
+    return cur.fetchone()[0] or "0"
+
+
+# Indexes on the columns the list table sorts by. Each one also holds the rowid,
+# so "ORDER BY col, b.id" walks the index and stops after one page.
+BOOK_INDEXES = {
+    "books_title_idx": "title",
+    "books_author_idx": "author",
+    "books_published_date_idx": "published_date",
+    "books_release_idx": "release",
+}
+
+# Schema migrations, applied in order. PRAGMA user_version holds the number of
+# migrations already applied; append new steps, never edit or reorder old ones.
+MIGRATIONS = [
+    META_SCHEMA,
+    SEARCH_SCHEMA + ["INSERT INTO books_fts (books_fts) VALUES ('rebuild')"],
+    [
+        f"CREATE INDEX IF NOT EXISTS {name} ON books ({column})"
+        for name, column in BOOK_INDEXES.items()
+    ] + ["ANALYZE books"],
+    # published_date and release join the search index, for the list search box
+    DROP_SEARCH_SCHEMA + SEARCH_SCHEMA + ["INSERT INTO books_fts (books_fts) VALUES ('rebuild')"],
+]
+
+
+# Apply pending migrations, each in its own transaction together with its
+# user_version bump. BEGIN IMMEDIATE keeps workers starting at once from racing.
+def init_db():
+    conn = get_write_db()
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            return
+        for statement in MIGRATIONS[version]:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {version + 1}")
+        conn.commit()
+
+
 # ---------------- Database helper ----------------
 
+# Category list cache: categories almost never change, so the form dropdowns
+# are served from memory. Entries expire after CATEGORY_CACHE_TTL seconds, and
+# every CATEGORY_VERSION_CHECK seconds the categories_version counter is compared
+# so writes from other workers are picked up (None = rely on the TTL only).
+CATEGORY_CACHE_TTL = 300
+CATEGORY_VERSION_CHECK = 5
+
+_category_cache = None  # (rows, version, expires at, version checked at)
+
+
+# Drop the cached category list; call after writing to categories
+def invalidate_categories():
+    global _category_cache
+    _category_cache = None
+
+
 # Get all categories
 def get_categories():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    global _category_cache
+    now = time.monotonic()
+    cached = _category_cache
+    if cached is not None and now < cached[2]:
+        rows, version, expires, checked = cached
+        if CATEGORY_VERSION_CHECK is None or now < checked + CATEGORY_VERSION_CHECK:
+            return rows
+        if get_meta('categories_version') == version:
+            _category_cache = (rows, version, expires, now)
+            return rows
+
+    version = get_meta('categories_version')
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT id, name FROM categories ORDER BY name")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
-
-# Get all books
-def get_books():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    rows = [dict(r) for r in cur.fetchall()]
+    _category_cache = (rows, version, now + CATEGORY_CACHE_TTL, now)
+    return rows
+
+# Get one category, including its description
+def get_category(category_id):
+    cur = get_db().execute(
+        "SELECT id, name, description FROM categories WHERE id = ?", (category_id,)
+    )
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+# Insert a new category; returns its id
+def insert_category(data):
+    category_id, _ = run_write(
+        "INSERT INTO categories (name, description) VALUES (?, ?)",
+        (data.get('name'), data.get('description'))
+    )
+    invalidate_categories()
+    page_cache.clear()
+    return category_id
+
+# Update a category; returns False if there is no such category
+def update_category(category_id, data):
+    _, count = run_write(
+        "UPDATE categories SET name=?, description=? WHERE id=?",
+        (data.get('name'), data.get('description'), category_id)
+    )
+    invalidate_categories()
+    page_cache.clear()
+    return count > 0
+
+# Delete a category; returns False if there is no such category
+def delete_category(category_id):
+    _, count = run_write("DELETE FROM categories WHERE id=?", (category_id,))
+    invalidate_categories()
+    page_cache.clear()
+    return count > 0
+
+# Number of books in a category
+def count_books_in_category(category_id):
+    cur = get_db().execute("SELECT COUNT(*) FROM books WHERE category_id = ?", (category_id,))
+    return cur.fetchone()[0]
+
+# Every column a book row can have, as name -> SQL expression over "books b
+# LEFT JOIN categories c". The `fields` arguments below pick from these names.
+BOOK_COLUMNS = {
+    "id": "b.id",
+    "title": "b.title",
+    "hepburn": "b.hepburn",
+    "author": "b.author",
+    "published_date": "b.published_date",
+    "release": "b.release",
+    "url": "b.url",
+    "summary": "b.summary",
+    "category_id": "b.category_id",
+    "category_name": "c.name",
+}
+
+
+# SELECT list for the given field names (all columns when fields is None)
+def book_columns_sql(fields=None):
+    names = BOOK_COLUMNS if fields is None else fields
+    return ", ".join(f"{BOOK_COLUMNS[name]} AS {name}" for name in names)
+
+# Row type for lists of books: a namedtuple named Book with one field per
+# selected column, made once per column list. A row is then a single tuple
+# instead of a sqlite3.Row copied into a 10-key dict; templates still read
+# b.title, and b._asdict() gives a dict for JSON.
+@functools.lru_cache(maxsize=None)
+def book_type(names):
+    return namedtuple("Book", names)
+
+
+# row_factory that builds Book tuples for the given columns
+def book_row_factory(fields=None):
+    make = book_type(tuple(BOOK_COLUMNS if fields is None else fields))._make
+    return lambda cursor, row: make(row)
+
+# Get all books, or with `after`/`limit` the books with id > after, `limit` at a time.
+# Returns a list of Book tuples (see book_type).
+def get_books(fields=None, after=None, limit=None):
+    conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT b.id, b.title, b.hepburn, b.author, b.published_date,
-               b.release, b.url, b.summary, b.category_id, c.name AS category_name
+    cur.row_factory = book_row_factory(fields)
+    where, params = "", []
+    if after is not None:
+        where = "WHERE b.id > ?"
+        params.append(after)
+    if limit is not None:
+        params.append(limit)
+    cur.execute(f"""
+        SELECT {book_columns_sql(fields)}
+        FROM books b
+        LEFT JOIN categories c ON b.category_id = c.id
+        {where}
+        ORDER BY b.id
+        {"LIMIT ?" if limit is not None else ""}
+    """, params)
+    return cur.fetchall()
+
+# Iterate over all books as Book tuples without loading them into a list.
+# Rows are fetched EXPORT_BATCH_SIZE at a time through fetchmany(), so the
+# fetch time counts toward the request's SQL time and the slow-query log.
+def iter_books(fields=None):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.row_factory = book_row_factory(fields)
+    cur.execute(f"""
+        SELECT {book_columns_sql(fields)}
         FROM books b
         LEFT JOIN categories c ON b.category_id = c.id
         ORDER BY b.id
     """)
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    try:
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cur.close()
 
-# Get a single book by id
-def get_book(book_id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Columns shown by list.html, in table order (DataTables sorts by column index).
+# Books without a category sort as '', so every sort key can be compared in a seek.
+LIST_COLUMNS = [
+    ("id", "b.id"),
+    ("title", "b.title"),
+    ("author", "b.author"),
+    ("published_date", "b.published_date"),
+    ("release", "b.release"),
+    ("category_name", "IFNULL(c.name, '')"),
+]
+
+# The fields list.html displays. Lists leave out summary and url, by far the
+# largest columns; /api/books/<id>/summary loads one summary when it is needed.
+LIST_FIELDS = tuple(name for name, _ in LIST_COLUMNS)
+
+# Get one page of books for the list table.
+# Returns (total rows, rows matching search, page rows)
+#
+# With `after` or `before` set to the (sort value, id) of a row on the
+# neighbouring page, the page is found by seeking from that row instead of
+# skipping `start` rows, so deep pages cost the same as the first one.
+def get_books_page(start=0, length=10, order_column=0, order_dir="asc", search="",
+                   after=None, before=None):
+    conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
+    conditions, params = [], []
+    source = "books b"
+    if search:
+        # Every displayed column but the category is in the search index. Category
+        # names are matched in the small categories table and their books found
+        # through books.category_id's index. The matching ids drive the query
+        # (CROSS JOIN keeps that order), so books is never scanned.
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        matches = ["""
+            SELECT id FROM books
+            WHERE category_id IN (SELECT id FROM categories WHERE name LIKE ? ESCAPE '\\')
+        """]
+        params.append(pattern)
+        match = fts_query(search)
+        if match:
+            matches.insert(0, "SELECT rowid AS id FROM books_fts WHERE books_fts MATCH ?")
+            params.insert(0, match)
+        source = f"({' UNION '.join(matches)}) AS m CROSS JOIN books b ON b.id = m.id"
+
+    cur.execute("SELECT COUNT(*) FROM books")
+    total = cur.fetchone()[0]
+    if search:
+        cur.execute(f"SELECT COUNT(*) FROM ({' UNION '.join(matches)})", params)
+        filtered = cur.fetchone()[0]
+    else:
+        filtered = total
+
+    sort_column = LIST_COLUMNS[order_column][1]
+    descending = order_dir == "desc"
+    backward = before is not None and after is None
+    if after is not None or before is not None:
+        # Seeking backward walks the index in the opposite order, then flips the page
+        op = ">" if descending == backward else "<"
+        conditions.append(f"({sort_column}, b.id) {op} (?, ?)")
+        params.extend(after if after is not None else before)
+        offset = 0
+    else:
+        offset = start
+    direction = "DESC" if descending != backward else "ASC"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = ", ".join(f"{sql} AS {name}" for name, sql in LIST_COLUMNS)
+    cur.execute(f"""
+        SELECT {columns}
+        FROM {source}
+        LEFT JOIN categories c ON b.category_id = c.id
+        {where}
+        ORDER BY {sort_column} {direction}, b.id {direction}
+        LIMIT ? OFFSET ?
+    """, params + [length, offset])
+    rows = [dict(r) for r in cur.fetchall()]
+    if backward:
+        rows.reverse()
+    return total, filtered, rows
+
+
+# Opaque pagination cursor: the sort key of a row, as URL-safe base64 JSON
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+
+# A (sort value, id) pair from a cursor that can be bound in the seek query.
+# Cursors are not signed, so anything else is ignored.
+def valid_seek_key(key):
+    value, book_id = key
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return False
+    if isinstance(value, int) and not -SQLITE_MAX_INT - 1 <= value <= SQLITE_MAX_INT:
+        return False
+    return type(book_id) is int and 0 <= book_id <= SQLITE_MAX_INT
+
+# ---------------- Full-text search ----------------
+
+# Weights for bm25(), one per SEARCH_COLUMNS entry
+SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 1.0, 1.0, 1.0)
+
+# Markers used by highlight()/snippet(); replaced by <mark> after HTML-escaping
+HL_OPEN, HL_CLOSE = "\x02", "\x03"
+
+
+# Turn free text into an FTS5 query: every word must match, each as a prefix.
+# Returns None when there is nothing to search for.
+def fts_query(text):
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def highlight_html(text):
+    if text is None:
+        return None
+    return Markup(str(escape(text)).replace(HL_OPEN, "<mark>").replace(HL_CLOSE, "</mark>"))
+
+
+# Search books by the SEARCH_COLUMNS, best matches first.
+# Returns (number of matches, result rows with highlighted title and summary snippet)
+def search_books(text, limit=20, offset=0):
+    match = fts_query(text)
+    if not match:
+        return 0, []
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH ?", (match,))
+    total = cur.fetchone()[0]
+    cur.execute(f"""
         SELECT b.id, b.title, b.hepburn, b.author, b.published_date,
-               b.release, b.url, b.summary,
-               b.category_id, c.name AS category_name
+               b.release, c.name AS category_name,
+               highlight(books_fts, 0, '{HL_OPEN}', '{HL_CLOSE}') AS title_highlight,
+               snippet(books_fts, 3, '{HL_OPEN}', '{HL_CLOSE}', '…', 24) AS snippet,
+               bm25(books_fts, {", ".join("?" for _ in SEARCH_WEIGHTS)}) AS score
+        FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        LEFT JOIN categories c ON b.category_id = c.id
+        WHERE books_fts MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, (*SEARCH_WEIGHTS, match, limit, offset))
+    results = []
+    for r in cur.fetchall():
+        row = dict(r)
+        row['title_highlight'] = highlight_html(row['title_highlight'])
+        row['snippet'] = highlight_html(row['snippet'])
+        results.append(row)
+    return total, results
+
+# Get a single book by id
+def get_book(book_id, fields=None):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {book_columns_sql(fields)}
         FROM books b
         LEFT JOIN categories c ON b.category_id = c.id
         WHERE b.id = ?
     """, (book_id,))
     row = cur.fetchone()
-    conn.close()
     return dict(row) if row else None
 
-# Insert a new book
-def insert_book(data):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO books (title, hepburn, author, published_date, release, url, summary, category_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+# Values of a book form, in the column order used by insert_book and update_book
+def book_values(data):
+    return (
         data.get('title'),
         data.get('hepburn'),
         data.get('author'),
@@ -120,51 +1534,552 @@ def insert_book(data):
         data.get('url'),
         data.get('summary'),
         data.get('category_id') or None
-    ))
-    conn.commit()
-    conn.close()
+    )
+
+# Insert a new book; returns its id
+def insert_book(data):
+    book_id, _ = run_write("""
+        INSERT INTO books (title, hepburn, author, published_date, release, url, summary, category_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, book_values(data))
+    page_cache.clear()
+    return book_id
 
-# Update an existing book
+# Update an existing book; returns False if there is no such book
 def update_book(book_id, data):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
+    _, count = run_write("""
         UPDATE books
         SET title=?, hepburn=?, author=?, published_date=?, release=?, url=?, summary=?, category_id=?
         WHERE id=?
-    """, (
-        data.get('title'),
-        data.get('hepburn'),
-        data.get('author'),
-        data.get('published_date'),
-        data.get('release'),
-        data.get('url'),
-        data.get('summary'),
-        data.get('category_id') or None,
-        book_id
-    ))
-    conn.commit()
-    conn.close()
+    """, book_values(data) + (book_id,))
+    page_cache.clear()
+    return count > 0
 
-# Delete a book
+# Delete a book; returns False if there is no such book
 def delete_book(book_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM books WHERE id=?", (book_id,))
-    conn.commit()
-    conn.close()
+    _, count = run_write("DELETE FROM books WHERE id=?", (book_id,))
+    page_cache.clear()
+    return count > 0
+
+# ---------------- Bulk import ----------------
+
+IMPORT_BATCH_SIZE = 10000  # rows inserted per transaction
+IMPORT_MAX_ERRORS = 20     # rejected rows listed in the import report
+
+# Book columns filled from import records; missing text fields are stored as ''
+IMPORT_FIELDS = ("title", "hepburn", "author", "published_date", "release", "url", "summary")
+
+
+class ImportReport:
+    """Counters for one bulk import."""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.created_categories = 0
+        self.errors = []  # (record number, message), at most IMPORT_MAX_ERRORS
+        self.started = time.perf_counter()
+
+    def reject(self, number, message):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((number, message))
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return dict(
+            imported=self.imported,
+            rejected=self.rejected,
+            created_categories=self.created_categories,
+            errors=[dict(record=n, message=m) for n, m in self.errors],
+            seconds=round(self.seconds, 3)
+        )
+
+
+# Read book records from a text stream, one at a time.
+# fmt is "csv" (header row required) or "jsonl" (one JSON object per line);
+# a line that is not valid JSON is passed on as a ValueError for import_books to reject.
+def parse_books(stream, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield ValueError(f"invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}'. Must be 'csv' or 'jsonl'")
+
+
+# Per-row triggers on books that a bulk insert replaces with one set-based statement each
+BULK_SUSPENDED_TRIGGERS = ("books_fts_insert", "books_version_insert")
+
+
+# Insert rows of (title, ..., summary, category_id) in one write transaction.
+# The per-row search-index and version triggers are dropped for the duration and
+# their work is done once for the whole batch. The DDL is part of the transaction,
+# so other connections never see the triggers missing.
+def insert_batch(conn, rows):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        placeholders = ", ".join("?" for _ in BULK_SUSPENDED_TRIGGERS)
+        triggers = conn.execute(
+            f"SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({placeholders})",
+            BULK_SUSPENDED_TRIGGERS
+        ).fetchall()
+        for name in BULK_SUSPENDED_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM books").fetchone()[0]
+        conn.executemany("""
+            INSERT INTO books (title, hepburn, author, published_date, release, url, summary, category_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.execute(f"""
+            INSERT INTO books_fts (rowid, {_fts_columns})
+            SELECT id, {_fts_columns} FROM books WHERE id > ?
+        """, (last_id,))
+        conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'books_version'")
+        for (sql,) in triggers:
+            conn.execute(sql)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+# Insert book records in batches of batch_size rows, one transaction per batch.
+# A record names its category by category_id or by name (category / category_name);
+# unknown names are created. progress(report) is called after every batch.
+#
+# Each batch is read from `records` first and only then takes the writer
+# connection, so a slow upload does not hold up other writes while it arrives.
+def import_books(records, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    report = ImportReport()
+    category_ids = {c['name']: c['id'] for c in get_categories()}
+    known_ids = set(category_ids.values())
+
+    def category_for(conn, record):
+        category_id = record.get('category_id')
+        if category_id not in (None, ""):
+            # An integer, or its digits as text (CSV); floats like 1e999 are refused
+            if isinstance(category_id, str) and category_id.isascii() and category_id.isdigit():
+                category_id = int(category_id)
+            elif type(category_id) is not int:
+                raise ValueError("category_id must be an integer")
+            if category_id not in known_ids:
+                raise ValueError(f"unknown category_id {category_id}")
+            return category_id
+        name = record.get('category') or record.get('category_name') or ""
+        if not isinstance(name, str):
+            raise ValueError("category must be a string")
+        name = name.strip()
+        if not name:
+            raise ValueError("missing category")
+        if name not in category_ids:
+            # Another writer may have added it since the categories were read
+            cur = conn.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (name,))
+            report.created_categories += cur.rowcount
+            category_ids[name] = conn.execute(
+                "SELECT id FROM categories WHERE name = ?", (name,)
+            ).fetchone()[0]
+            known_ids.add(category_ids[name])
+        return category_ids[name]
+
+    def rows(conn, batch, first):
+        for number, record in enumerate(batch, first):
+            try:
+                if isinstance(record, ValueError):
+                    raise record
+                if not isinstance(record, dict):
+                    raise ValueError("record is not an object")
+                for f in IMPORT_FIELDS:
+                    if not isinstance(record.get(f), (str, type(None))):
+                        raise ValueError(f"{f} must be a string")
+                if not (record.get('title') or "").strip():
+                    raise ValueError("missing title")
+                values = [record.get(f) or "" for f in IMPORT_FIELDS]
+                values.append(category_for(conn, record))
+            except (TypeError, ValueError) as e:
+                report.reject(number, str(e))
+                continue
+            report.imported += 1
+            yield values
+
+    records = iter(records)
+    first = 1
+    try:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            with write_connection() as conn:
+                insert_batch(conn, rows(conn, batch, first))
+            first += len(batch)
+            if progress:
+                progress(report)
+    finally:
+        if report.created_categories:
+            invalidate_categories()
+        if report.imported:
+            page_cache.clear()
+    return report
+
+
+# ---------------- Export ----------------
+
+EXPORT_BATCH_SIZE = 1000  # rows fetched from the cursor at a time
+
+# Columns of an exported book, the same as get_books()
+EXPORT_COLUMNS = (
+    "id", "title", "hepburn", "author", "published_date",
+    "release", "url", "summary", "category_id", "category_name",
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+# Yield every book as lists of at most batch_size tuples, in EXPORT_COLUMNS order
+def iter_book_batches(batch_size=EXPORT_BATCH_SIZE):
+    cur = get_db().cursor()
+    cur.execute("""
+        SELECT b.id, b.title, b.hepburn, b.author, b.published_date,
+               b.release, b.url, b.summary, b.category_id, c.name AS category_name
+        FROM books b
+        LEFT JOIN categories c ON b.category_id = c.id
+        ORDER BY b.id
+    """)
+    try:
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+    finally:
+        cur.close()
+
+
+def export_csv(batches):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def export_jsonl(batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, r)), ensure_ascii=False) + "\n" for r in rows)
+
+
+# Column-oriented JSON, one block per batch so it can be written as it is read:
+# {"columns": [...], "blocks": [{"id": [...], "title": [...], ...}, ...]}
+def export_columnar(batches):
+    yield '{"columns": ' + json.dumps(EXPORT_COLUMNS) + ', "blocks": ['
+    separator = ""
+    for rows in batches:
+        block = dict(zip(EXPORT_COLUMNS, map(list, zip(*rows))))
+        yield separator + json.dumps(block, ensure_ascii=False)
+        separator = ", "
+    yield "]}\n"
+
+
+EXPORTERS = {
+    "csv": export_csv,
+    "jsonl": export_jsonl,
+    "json": export_columnar,
+}
+
+
+# Stream the whole catalog in fmt as UTF-8 chunks, gzip-compressed on the fly if asked
+def export_books(fmt, compress=False, batch_size=EXPORT_BATCH_SIZE):
+    chunks = (c.encode("utf-8") for c in EXPORTERS[fmt](iter_book_batches(batch_size)))
+    if not compress:
+        yield from chunks
+        return
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = gz.compress(chunk)
+        if data:
+            yield data
+    yield gz.flush()
+
+
+# ---------------- Conditional GET ----------------
+
+# Fingerprint of the code, templates, asset manifest and critical CSS, so a deploy
+# or an asset rebuild changes every ETag
+def _code_version():
+    root = app.root_path
+    paths = [os.path.join(root, 'app.py')]
+    if os.path.exists(ASSET_MANIFEST):
+        paths.append(ASSET_MANIFEST)
+    # The critical CSS is inlined into every page
+    if os.path.isdir(CRITICAL_DIR):
+        paths.extend(e.path for e in os.scandir(CRITICAL_DIR) if e.name.endswith(".css"))
+    for folder, _, files in os.walk(os.path.join(root, 'templates')):
+        paths.extend(os.path.join(folder, f) for f in files)
+    mtimes = ",".join(f"{os.path.getmtime(p):.0f}" for p in sorted(paths))
+    return hashlib.sha1(mtimes.encode()).hexdigest()[:12]
+
+
+CODE_VERSION = _code_version()
+
+
+# Cache key of the current page: URL, active theme, data version and code version
+def page_key():
+    if 'page_key' not in g:
+        theme = session.get('theme', TEMPLATE_MODULE)
+        key = f"{CODE_VERSION}|{theme}|{data_version()}|{request.full_path}"
+        g.page_key = hashlib.sha1(key.encode()).hexdigest()
+    return g.page_key
+
+
+# Answer GET requests with 304 Not Modified when the client already has the
+# current page. The ETag is the page key, so matching requests skip both the
+# queries and the template rendering.
+def conditional(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = page_key()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+
+# ---------------- Page cache ----------------
+
+class MemoryPageCache:
+    """In-process LRU cache of rendered pages."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FilePageCache:
+    """
+    Rendered pages stored as files, shared by every worker on the host.
+    Point it at a tmpfs such as /dev/shm to keep it in shared memory.
+    """
+
+    def __init__(self, directory, max_entries=4096):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                mimetype, _, body = f.read().partition(b"\n")
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return body, mimetype.decode()
+
+    def set(self, key, value):
+        body, mimetype = value
+        # A unique temp file, so threads storing the same page do not share one
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(mimetype.encode() + b"\n" + body)
+        os.replace(tmp, self._path(key))
+        if len(self) > self.max_entries:
+            self._prune()
+
+    def _prune(self):
+        entries = [e for e in os.scandir(self.directory) if not e.name.endswith(".tmp")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return sum(1 for e in os.scandir(self.directory) if not e.name.endswith(".tmp"))
+
+
+# Backend for rendered pages; e.g. FilePageCache("/dev/shm/books-pages") for multi-worker setups
+page_cache = MemoryPageCache()
+
+
+# Serve the page from the page cache, rendering and storing it on a miss.
+# Entries are keyed by page_key(), so any data change makes old entries unreachable.
+def cached(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = page_key()
+        hit = page_cache.get(key)
+        if hit is not None:
+            body, mimetype = hit
+            return app.response_class(body, mimetype=mimetype)
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            page_cache.set(key, (response.get_data(), response.mimetype))
+        return response
+    return wrapper
 
 
 # ---------------- Routes ----------------
 
+# Render list.html in the configured mode: empty table for server-side paging,
+# rows streamed from the cursor, or every row rendered up front
+def render_list(**context):
+    if SERVER_SIDE_LIST:
+        return render_template(template_path('list'), books=[], server_side=True, **context)
+    if STREAM_LIST:
+        return stream_template(template_path('list'), books=iter_books(LIST_FIELDS), server_side=False, **context)
+    books = get_books(LIST_FIELDS)
+    return render_template(template_path('list'), books=books, server_side=False, **context)
+
+# Integer query argument, clamped to [low, high] so it can always be bound in SQL
+def int_arg(name, default, low=0, high=SQLITE_MAX_INT, args=None):
+    value = (request.args if args is None else args).get(name, default, type=int)
+    return min(max(value, low), high)
+
 # List all books
 @app.route('/')
+@conditional
+@cached
 def index():
-    books = get_books()
-    return render_template(template_path('list'), books=books)
+    return render_list()
+
+# DataTables server-side endpoint: returns only the rows of the visible page
+# Not conditional or cached: DataTables sends a new `draw` counter with every
+# request, so no two URLs repeat and each would only evict a real page
+@app.route('/books.json')
+def books_data():
+    args = request.args
+    start = int_arg('start', 0)
+    length = args.get('length', 10, type=int)
+    if length < 1 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+    order_column = args.get('order[0][column]', 0, type=int)
+    if not 0 <= order_column < len(LIST_COLUMNS):
+        order_column = 0
+    order_dir = args.get('order[0][dir]', 'asc')
+    search = args.get('search[value]', '').strip()
+
+    # A cursor is only used for the exact page, sort and search it was issued for;
+    # anything else (e.g. jumping to a page) falls back to OFFSET
+    after = before = None
+    page = [order_column, order_dir, search, start]
+    values = decode_cursor(args.get('cursor', ''))
+    if values and len(values) == 7 and values[:4] == page and valid_seek_key(values[4:6]):
+        if values[6] == "next":
+            after = values[4:6]
+        else:
+            before = values[4:6]
+
+    total, filtered, rows = get_books_page(start, length, order_column, order_dir, search,
+                                           after, before)
+
+    # Cursors for the neighbouring pages, keyed by their start
+    cursors = {}
+    if rows:
+        key = LIST_COLUMNS[order_column][0]
+        first, last = rows[0], rows[-1]
+        if start + length < filtered and len(rows) == length:
+            cursors[start + length] = encode_cursor(
+                [order_column, order_dir, search, start + length, last[key], last['id'], "next"])
+        if start >= length:
+            cursors[start - length] = encode_cursor(
+                [order_column, order_dir, search, start - length, first[key], first['id'], "prev"])
+    return jsonify(
+        draw=args.get('draw', 0, type=int),
+        recordsTotal=total,
+        recordsFiltered=filtered,
+        data=rows,
+        cursors=cursors
+    )
+
+SEARCH_PAGE_RESULTS = 200  # best matches listed on /search
+
+# Search page: the list view with the best full-text matches, ranked by bm25,
+# each with its highlighted title and a summary snippet
+@app.route('/search')
+@conditional
+@cached
+def search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return render_list()
+    _, results = search_books(q, SEARCH_PAGE_RESULTS)
+    return render_template(template_path('list'), books=results, server_side=False, ranked=True, search=q)
+
+# Search API: ranked matches with highlighted title and summary snippet
+@app.route('/api/search')
+@conditional
+@cached
+def api_search():
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PAGE_LENGTH)
+    offset = int_arg('offset', 0)
+    total, results = search_books(q, limit, offset)
+    return jsonify(query=q, total=total, results=results)
 
 # View a single book
 @app.route('/view/<int:book_id>')
+@conditional
+@cached
 def view(book_id):
     book = get_book(book_id)
     return render_template(template_path('view'), book=book)
@@ -172,29 +2087,523 @@ def view(book_id):
 # Edit a book
 @app.route('/edit/<int:book_id>', methods=['GET', 'POST'])
 def edit(book_id):
-    book = get_book(book_id)
-    categories = get_categories()  # Fetch categories for dropdown
     if request.method == 'POST':
         update_book(book_id, request.form)
         return redirect(url_for('index'))
+    book = get_book(book_id)
+    if book is None:
+        abort(404)
+    categories = get_categories()  # Dropdown data, served from the category cache
     return render_template(template_path('form'), book=book, categories=categories)
 
 # Add a new book
 @app.route('/add', methods=['GET', 'POST'])
 def add():
-    categories = get_categories()  # Fetch categories for dropdown
     if request.method == 'POST':
         insert_book(request.form)
         return redirect(url_for('index'))
+    categories = get_categories()  # Dropdown data, served from the category cache
     return render_template(template_path('form'), book=None, categories=categories)
 
 
+
+# Bulk import: CSV or JSON Lines in the request body, parsed while it is read.
+# The format comes from ?format= or the Content-Type header.
+@app.route('/api/books/bulk', methods=['POST'])
+def bulk_import():
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = "csv" if request.mimetype == "text/csv" else "jsonl"
+    if fmt not in ("csv", "jsonl"):
+        abort(400)
+    batch_size = min(max(request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int), 1), 100000)
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="")
+    try:
+        report = import_books(parse_books(stream, fmt), batch_size)
+    except (ValueError, csv.Error) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report.as_dict())
+
+# Export the catalog: /export/books.csv, /export/books.jsonl or /export/books.json.
+# Rows are streamed from the cursor; gzip is used when the client accepts it.
+@app.route('/export/books.<fmt>')
+def export(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    compress = request.accept_encodings['gzip'] > 0
+    response = app.response_class(
+        stream_with_context(export_books(fmt, compress)),
+        mimetype=EXPORT_FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="books.{fmt}"'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 # Delete a book
 @app.route('/delete/<int:book_id>')
 def delete(book_id):
     delete_book(book_id)
     return redirect(url_for('index'))
 
+# Page cache counters
+@app.route('/debug/page-cache')
+def page_cache_stats():
+    return jsonify(
+        backend=type(page_cache).__name__,
+        entries=len(page_cache),
+        hits=page_cache.hits,
+        misses=page_cache.misses
+    )
+
+
+# ---------------- JSON API ----------------
+
+API_PAGE_LENGTH = 50   # books per page of /api/books by default
+API_MAX_LIMIT = 1000   # largest page /api/books will return
+
+# Book fields a client can write; id and category_name are read-only
+BOOK_WRITABLE = IMPORT_FIELDS + ("category_id",)
+CATEGORY_WRITABLE = ("name", "description")
+# Writable fields that hold integers; every other one holds text
+INTEGER_FIELDS = ("category_id",)
+
+
+# Compact JSON response, through orjson when it is installed
+def json_response(payload, status=200):
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+def api_error(status, message):
+    return json_response({"error": message}, status)
+
+
+# Field names from ?fields=a,b (None = all). Unknown names abort with 400.
+# These helpers read Flask's request unless given another (the ASGI app's).
+def requested_fields(req=request):
+    value = req.args.get('fields')
+    if not value:
+        return None
+    # A name given twice is returned once (Book rows cannot repeat a field)
+    fields = list(dict.fromkeys(f.strip() for f in value.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in BOOK_COLUMNS]
+    if unknown or not fields:
+        abort(api_error(400, f"Unknown fields: {', '.join(unknown)}"))
+    return fields
+
+
+# Whether a JSON value fits a writable field: an integer SQLite can bind for
+# INTEGER_FIELDS, a string for the rest, or null
+def valid_field_value(name, value):
+    if value is None:
+        return True
+    if name in INTEGER_FIELDS:
+        return type(value) is int and -SQLITE_MAX_INT - 1 <= value <= SQLITE_MAX_INT
+    return isinstance(value, str)
+
+
+# JSON object from the request body, limited to the writable names and to
+# values of each field's type
+def request_object(writable, req=request):
+    data = req.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(api_error(400, "Expected a JSON object"))
+    unknown = [k for k in data if k not in writable]
+    if unknown:
+        abort(api_error(400, f"Unknown or read-only fields: {', '.join(unknown)}"))
+    invalid = [k for k, v in data.items() if not valid_field_value(k, v)]
+    if invalid:
+        abort(api_error(400, f"Invalid values for: {', '.join(invalid)}. Integer fields "
+                             f"({', '.join(INTEGER_FIELDS)}) take an integer, the others a string or null"))
+    return data
+
+
+# 400 unless the book's category_id names an existing category. Foreign keys
+# are not enforced, so SQLite would store any value.
+def check_book_category(data):
+    category_id = data.get('category_id')
+    if category_id is not None and get_category(category_id) is None:
+        abort(api_error(400, f"Unknown category_id: {category_id}"))
+
+
+# Run a write helper, turning constraint errors into 400/409 responses
+def api_write(helper, *args):
+    try:
+        return helper(*args)
+    except sqlite3.IntegrityError as e:
+        status = 409 if "UNIQUE" in str(e) else 400
+        abort(api_error(status, str(e)))
+
+
+# Query of one /api/books page: (fields, query_fields, after, limit).
+# query_fields adds the id the next cursor is made from.
+def book_list_query(req=request):
+    fields = requested_fields(req)
+    limit = min(max(req.args.get('limit', API_PAGE_LENGTH, type=int), 1), API_MAX_LIMIT)
+    after = None
+    token = req.args.get('cursor')
+    if token:
+        values = decode_cursor(token)
+        if not values or not isinstance(values[0], int) or not 0 <= values[0] <= SQLITE_MAX_INT:
+            abort(api_error(400, "Invalid cursor"))
+        after = values[0]
+    query_fields = fields if fields is None or "id" in fields else ["id"] + fields
+    return fields, query_fields, after, limit
+
+
+# Body of one /api/books page, from up to limit + 1 books
+def book_list_payload(books, fields, query_fields, limit):
+    next_cursor = encode_cursor([books[limit - 1].id]) if len(books) > limit else None
+    rows = [book._asdict() for book in books[:limit]]
+    if query_fields is not fields:
+        for row in rows:
+            del row["id"]
+    return {"data": rows, "next_cursor": next_cursor}
+
+
+# Books by id, `limit` at a time: {"data": [...], "next_cursor": token or null}
+@app.route('/api/books')
+@conditional
+@cached
+def api_books():
+    fields, query_fields, after, limit = book_list_query()
+    books = get_books(query_fields, after, limit + 1)
+    return json_response(book_list_payload(books, fields, query_fields, limit))
+
+
+@app.route('/api/books', methods=['POST'])
+def api_create_book():
+    data = request_object(BOOK_WRITABLE)
+    check_book_category(data)
+    book_id = api_write(insert_book, data)
+    response = json_response(get_book(book_id), 201)
+    response.headers['Location'] = url_for('api_book', book_id=book_id)
+    return response
+
+
+@app.route('/api/books/<int:book_id>')
+@conditional
+@cached
+def api_book(book_id):
+    book = get_book(book_id, requested_fields())
+    if book is None:
+        return api_error(404, "Book not found")
+    return json_response(book)
+
+
+# One book's summary, for list rows that expand on demand
+@app.route('/api/books/<int:book_id>/summary')
+@conditional
+@cached
+def api_book_summary(book_id):
+    book = get_book(book_id, ("id", "summary"))
+    if book is None:
+        return api_error(404, "Book not found")
+    return json_response(book)
+
+
+# PUT replaces every writable field; PATCH changes only the fields it sends
+@app.route('/api/books/<int:book_id>', methods=['PUT', 'PATCH'])
+def api_update_book(book_id):
+    data = request_object(BOOK_WRITABLE)
+    if request.method == 'PATCH':
+        book = get_book(book_id, BOOK_WRITABLE)
+        if book is None:
+            return api_error(404, "Book not found")
+        data = {**book, **data}
+    check_book_category(data)
+    if not api_write(update_book, book_id, data):
+        return api_error(404, "Book not found")
+    return json_response(get_book(book_id))
+
+
+@app.route('/api/books/<int:book_id>', methods=['DELETE'])
+def api_delete_book(book_id):
+    if not delete_book(book_id):
+        return api_error(404, "Book not found")
+    return app.response_class(status=204)
+
+
+@app.route('/api/categories')
+@conditional
+@cached
+def api_categories():
+    return json_response({"data": get_categories()})
+
+
+@app.route('/api/categories', methods=['POST'])
+def api_create_category():
+    data = request_object(CATEGORY_WRITABLE)
+    category_id = api_write(insert_category, data)
+    response = json_response(get_category(category_id), 201)
+    response.headers['Location'] = url_for('api_category', category_id=category_id)
+    return response
+
+
+@app.route('/api/categories/<int:category_id>')
+@conditional
+@cached
+def api_category(category_id):
+    category = get_category(category_id)
+    if category is None:
+        return api_error(404, "Category not found")
+    return json_response(category)
+
+
+@app.route('/api/categories/<int:category_id>', methods=['PUT', 'PATCH'])
+def api_update_category(category_id):
+    data = request_object(CATEGORY_WRITABLE)
+    if request.method == 'PATCH':
+        category = get_category(category_id)
+        if category is None:
+            return api_error(404, "Category not found")
+        data = {**category, **data}
+    if not api_write(update_category, category_id, data):
+        return api_error(404, "Category not found")
+    return json_response(get_category(category_id))
+
+
+# A category that still has books cannot be deleted
+@app.route('/api/categories/<int:category_id>', methods=['DELETE'])
+def api_delete_category(category_id):
+    if count_books_in_category(category_id):
+        return api_error(409, "Category still has books")
+    if not delete_category(category_id):
+        return api_error(404, "Category not found")
+    return app.response_class(status=204)
+
+
+# ---------------- Async data layer ----------------
+
+# Coroutine versions of the data helpers, for the ASGI app in asgi.py. Each call
+# runs the helper on a dedicated pool of ASYNC_DB_THREADS threads, in an app
+# context of its own, so it checks out a pooled connection (or hands its write
+# to the group-commit writer) without ever blocking the event loop.
+ASYNC_DB_THREADS = 16
+
+_db_executor = None
+_db_executor_pid = None
+_db_executor_lock = threading.Lock()
+
+
+# The executor, made on first use and again in a forked worker
+def db_executor():
+    global _db_executor, _db_executor_pid
+    if _db_executor_pid != os.getpid():
+        with _db_executor_lock:
+            if _db_executor_pid != os.getpid():
+                _db_executor = concurrent.futures.ThreadPoolExecutor(
+                    ASYNC_DB_THREADS, thread_name_prefix="books-db")
+                _db_executor_pid = os.getpid()
+    return _db_executor
+
+
+def _call_in_app_context(helper, args):
+    with app.app_context():
+        return helper(*args)
+
+
+# Await any helper (or function of helpers) on the database executor
+async def run_db(helper, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor(), _call_in_app_context, helper, args)
+
+
+async def get_books_async(fields=None, after=None, limit=None):
+    return await run_db(get_books, fields, after, limit)
+
+
+async def get_book_async(book_id, fields=None):
+    return await run_db(get_book, book_id, fields)
+
+
+async def get_categories_async():
+    return await run_db(get_categories)
+
+
+async def insert_book_async(data):
+    return await run_db(insert_book, data)
+
+
+async def update_book_async(book_id, data):
+    return await run_db(update_book, book_id, data)
+
+
+async def delete_book_async(book_id):
+    return await run_db(delete_book, book_id)
+
+
+async def data_version_async():
+    return await run_db(data_version)
+
+
+# ---------------- CLI ----------------
+
+@app.cli.group()
+def books():
+    """Manage the books database."""
+
+
+@books.command('reindex')
+def reindex_command():
+    """Rebuild the full-text search index from the books table."""
+    start = time.perf_counter()
+    rebuild_search_index()
+    click.echo(f"Search index rebuilt in {time.perf_counter() - start:.2f}s")
+
+
+@books.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help="Input format; guessed from the file extension when omitted.")
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              help="Rows inserted per transaction.")
+def import_command(source, fmt, batch_size):
+    """Import books from a CSV or JSON Lines file ('-' reads stdin)."""
+    if fmt is None:
+        fmt = "csv" if source.name.endswith(".csv") else "jsonl"
+
+    def progress(report):
+        click.echo(f"{report.imported} imported, {report.rejected} rejected "
+                   f"({report.imported / report.seconds:.0f} rows/s)", err=True)
+
+    report = import_books(parse_books(source, fmt), batch_size, progress)
+    for number, message in report.errors:
+        click.echo(f"record {number}: {message}", err=True)
+    click.echo(f"Imported {report.imported} books in {report.seconds:.2f}s "
+               f"({report.rejected} rejected, {report.created_categories} new categories)")
+
+
+
+@books.command('export')
+@click.argument('target', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)),
+              help="Output format; guessed from the file extension when omitted.")
+@click.option('--gzip', 'compress', is_flag=True,
+              help="Compress the output (implied by a .gz file name).")
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True,
+              help="Rows fetched from the database at a time.")
+def export_command(target, fmt, compress, batch_size):
+    """Export all books as CSV, JSON Lines or columnar JSON ('-' writes stdout)."""
+    name = target.name if isinstance(target.name, str) else ""
+    if name.endswith(".gz"):
+        compress = True
+        name = name[:-3]
+    if fmt is None:
+        fmt = os.path.splitext(name)[1].lstrip(".")
+        if fmt not in EXPORT_FORMATS:
+            fmt = "jsonl"
+    start = time.perf_counter()
+    for chunk in export_books(fmt, compress, batch_size):
+        target.write(chunk)
+    target.flush()
+    click.echo(f"Exported books as {fmt} in {time.perf_counter() - start:.2f}s", err=True)
+
+
+@app.cli.group()
+def themes():
+    """Manage the template themes."""
+
+
+@themes.command('precompile')
+@click.option('--clear', is_flag=True, help="Empty the bytecode cache first.")
+def precompile_command(clear):
+    """Compile every theme's templates into the shared bytecode cache."""
+    env = app.jinja_env
+    bytecode_cache = env.bytecode_cache
+    if clear:
+        bytecode_cache.clear()
+    # Importing app has already loaded everything (PRECOMPILE_TEMPLATES), so the
+    # compile times come from a pass that bypasses both caches
+    env.cache.clear()
+    env.bytecode_cache = None
+    try:
+        compiled = precompile_templates()
+    finally:
+        env.bytecode_cache = bytecode_cache
+    env.cache.clear()
+    precompile_templates()  # writes any bytecode that is missing
+    env.cache.clear()
+    loaded = precompile_templates()
+    click.echo(f"{'theme':<14} {'templates':>9} {'compile':>10} {'load':>10}")
+    for theme, (count, seconds) in compiled.items():
+        click.echo(f"{theme:<14} {count:>9} {seconds * 1000:>8.1f}ms {loaded[theme][1] * 1000:>8.1f}ms")
+    click.echo(f"{sum(count for count, _ in compiled.values())} templates compiled in "
+               f"{sum(seconds for _, seconds in compiled.values()):.2f}s, loaded from bytecode in "
+               f"{sum(seconds for _, seconds in loaded.values()):.2f}s "
+               f"(cache: {bytecode_cache.directory})")
+
+
+@app.cli.group()
+def assets():
+    """Manage the self-hosted static assets."""
+
+
+@assets.command('build')
+@click.option('--update-pins', is_flag=True,
+              help="Record the sha256 of new or changed downloads in ASSET_PINS instead of failing.")
+def build_assets_command(update_pins):
+    """Download every asset into ASSET_DIR under hashed names, with gzip/brotli copies."""
+    global asset_manifest
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    pins = load_asset_pins()
+    used = {} if update_pins else pins  # updating keeps only the pins still in use
+    manifest = {}
+    for name, url in ASSETS.items():
+        try:
+            manifest[name] = build_asset(name, url, used, update_pins)
+        except ValueError as e:
+            raise click.ClickException(f"{e}; check the download and rerun with --update-pins to accept it")
+        click.echo(f"{name:<26} {manifest[name]}")
+    if update_pins:
+        for url in sorted(set(pins) | set(used)):
+            if pins.get(url) != used.get(url):
+                change = "removed" if url not in used else "added" if url not in pins else "changed"
+                click.echo(f"pin {change}: {url}", err=True)
+        with open(ASSET_PINS, "w") as f:
+            json.dump(used, f, indent=2, sort_keys=True)
+            f.write("\n")
+    with open(ASSET_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    asset_manifest = manifest
+    if brotli is None:
+        click.echo("brotli is not installed; only .gz copies were written", err=True)
+
+
+@assets.command('critical')
+def critical_css_command():
+    """Extract each theme's critical CSS from the built stylesheets."""
+    global critical_styles
+    manifest = load_asset_manifest()
+    if not manifest:
+        raise click.ClickException("No built assets; run `flask assets build` first")
+    os.makedirs(CRITICAL_DIR, exist_ok=True)
+    with app.test_request_context():
+        asset_prefix = url_for('asset', filename='')
+    for theme in AVAILABLE_TEMPLATES:
+        css = build_critical_css(theme, manifest, asset_prefix)
+        path = os.path.join(CRITICAL_DIR, f"{theme}.css")
+        if css:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(css)
+        elif os.path.exists(path):
+            os.remove(path)
+        full = sum(os.path.getsize(os.path.join(ASSET_DIR, manifest[n]))
+                   for n in theme_stylesheets(theme) if n in manifest)
+        click.echo(f"{theme:<14} {len(css.encode()) / 1024:>7.1f} KB inline of {full / 1024:>7.1f} KB")
+    critical_styles = load_critical_css()
+
+with app.app_context():
+    init_db()
+
+if PRECOMPILE_TEMPLATES:
+    precompile_templates()
+
 # Dummy page
 # @app.route('/add', methods=['GET', 'POST'])
 # def add():
@@ -0,0 +1,312 @@
+"""
+ASGI entry point for the books app.
+
+    uvicorn asgi:application
+    hypercorn asgi:application
+
+The JSON book API (/api/books, /api/books/<id>, /api/books/<id>/summary and
+/api/categories) runs as coroutines that await the async data helpers in
+app.py, so a slow query only holds one of the ASYNC_DB_THREADS database
+threads, never the event loop. Every other route (the HTML pages, forms,
+search, import and export) is handed to the Flask app unchanged, on a pool of
+FLASK_THREADS threads, so the whole app works behind an ASGI server. Their
+request bodies are read as Flask asks for them and their responses are sent
+chunk by chunk, so uploads, exports and the streamed list are never held in
+memory whole.
+
+The coroutine views answer conditional GETs with the same kind of ETag as the
+Flask ones, but skip the page cache and the per-request metrics, which live in
+Flask's request context.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import os
+import sys
+import threading
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+import app as books
+
+FLASK_THREADS = 32  # requests served by the Flask app at once
+
+_flask_executor = None
+_flask_executor_pid = None
+_flask_executor_lock = threading.Lock()
+
+
+# The executor for Flask requests, made on first use and again in a forked worker
+def flask_executor():
+    global _flask_executor, _flask_executor_pid
+    if _flask_executor_pid != os.getpid():
+        with _flask_executor_lock:
+            if _flask_executor_pid != os.getpid():
+                _flask_executor = concurrent.futures.ThreadPoolExecutor(
+                    FLASK_THREADS, thread_name_prefix="books-flask")
+                _flask_executor_pid = os.getpid()
+    return _flask_executor
+
+
+# ---------------- Coroutine views ----------------
+
+# Answer with 304 when the client has the current version of this URL,
+# otherwise build the response and tag it
+async def conditional(req, build):
+    key = f"{books.CODE_VERSION}|asgi|{await books.data_version_async()}|{req.full_path}"
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    if req.if_none_match.contains(etag):
+        response = books.app.response_class(status=304)
+    else:
+        response = await build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def api_books(req):
+    fields, query_fields, after, limit = books.book_list_query(req)
+
+    async def build():
+        rows = await books.get_books_async(query_fields, after, limit + 1)
+        return books.json_response(books.book_list_payload(rows, fields, query_fields, limit))
+    return await conditional(req, build)
+
+
+async def api_create_book(req):
+    data = books.request_object(books.BOOK_WRITABLE, req)
+    await books.run_db(books.check_book_category, data)
+    book_id = await books.run_db(books.api_write, books.insert_book, data)
+    response = books.json_response(await books.get_book_async(book_id), 201)
+    response.headers['Location'] = f"/api/books/{book_id}"
+    return response
+
+
+async def api_book(req, book_id):
+    fields = books.requested_fields(req)
+
+    async def build():
+        book = await books.get_book_async(book_id, fields)
+        if book is None:
+            return books.api_error(404, "Book not found")
+        return books.json_response(book)
+    return await conditional(req, build)
+
+
+async def api_book_summary(req, book_id):
+    async def build():
+        book = await books.get_book_async(book_id, ("id", "summary"))
+        if book is None:
+            return books.api_error(404, "Book not found")
+        return books.json_response(book)
+    return await conditional(req, build)
+
+
+# PUT replaces every writable field; PATCH changes only the fields it sends
+async def api_update_book(req, book_id):
+    data = books.request_object(books.BOOK_WRITABLE, req)
+    if req.method == 'PATCH':
+        book = await books.get_book_async(book_id, books.BOOK_WRITABLE)
+        if book is None:
+            return books.api_error(404, "Book not found")
+        data = {**book, **data}
+    await books.run_db(books.check_book_category, data)
+    if not await books.run_db(books.api_write, books.update_book, book_id, data):
+        return books.api_error(404, "Book not found")
+    return books.json_response(await books.get_book_async(book_id))
+
+
+async def api_delete_book(req, book_id):
+    if not await books.delete_book_async(book_id):
+        return books.api_error(404, "Book not found")
+    return books.app.response_class(status=204)
+
+
+async def api_categories(req):
+    async def build():
+        return books.json_response({"data": await books.get_categories_async()})
+    return await conditional(req, build)
+
+
+# Flask endpoint -> coroutine view; the Flask url_map does the routing
+ASYNC_VIEWS = {
+    "api_books": api_books,
+    "api_create_book": api_create_book,
+    "api_book": api_book,
+    "api_book_summary": api_book_summary,
+    "api_update_book": api_update_book,
+    "api_delete_book": api_delete_book,
+    "api_categories": api_categories,
+}
+
+
+# ---------------- ASGI adapter ----------------
+
+class RequestBody(io.RawIOBase):
+    """
+    The request body as wsgi.input for a Flask thread: each read waits on the
+    event loop for the next http.request message, so an upload is parsed as
+    it arrives instead of being held in memory first.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive, self._loop = receive, loop
+        self._buffer, self._done = b"", False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self._done = True
+            return
+        self._buffer += message.get("body", b"")
+        self._done = not message.get("more_body")
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            self._fill()
+        n = min(len(b), len(self._buffer))
+        b[:n], self._buffer = self._buffer[:n], self._buffer[n:]
+        return n
+
+
+# WSGI environ for an ASGI http scope. The body is read from body_stream until
+# it ends, so wsgi.input_terminated is set and CONTENT_LENGTH is only passed on.
+def wsgi_environ(scope, body_stream):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body_stream,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1").upper().replace("-", "_"), value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def response_start(status, headers):
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    }
+
+
+async def send_response(send, response):
+    await send(response_start(response.status, response.headers.items()))
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+# Run the Flask app and its response iterator on one executor thread, sending
+# each chunk as it is produced. Streamed pages keep Flask's request context in
+# their generators, which has to be entered and left on the same thread.
+# Waiting for each send also stops a slow client from piling up chunks here.
+def run_flask(environ, send, loop):
+    def call(coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    started = []  # [status, headers] from start_response
+    pending = []  # chunks passed to write() before the iterator's
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started and started[0] is None:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [status, headers]
+        return pending.append
+
+    def send_chunk(chunk):
+        if started[0] is not None:
+            call(send(response_start(*started)))
+            started[0] = None  # headers sent
+        call(send({"type": "http.response.body", "body": chunk, "more_body": True}))
+
+    iterable = books.app(environ, start_response)
+    try:
+        for chunk in iterable:
+            for written in pending:
+                send_chunk(written)
+            pending.clear()
+            if chunk:
+                send_chunk(chunk)
+        for written in pending:
+            send_chunk(written)
+        if started[0] is not None:
+            call(send(response_start(*started)))
+        call(send({"type": "http.response.body", "body": b""}))
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+
+async def handle(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    environ = wsgi_environ(scope, io.BufferedReader(RequestBody(receive, loop)))
+    try:
+        endpoint, args = books.app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None  # Flask answers 404, 405 and redirects itself
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is None:
+        return await loop.run_in_executor(flask_executor(), run_flask, environ, send, loop)
+    # The coroutine views take small JSON bodies, read here without a thread
+    body = await read_body(receive)
+    environ["wsgi.input"], environ["CONTENT_LENGTH"] = io.BytesIO(body), str(len(body))
+    try:
+        response = await view(Request(environ), **args)
+    except HTTPException as e:
+        response = e.get_response(environ)
+    await send_response(send, response)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            books.db_executor().shutdown(wait=True)
+            flask_executor().shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+    await handle(scope, receive, send)
@@ -0,0 +1,717 @@
+"""
+Small benchmarks for the books app.
+
+Each benchmark runs against a temporary copy of db.sqlite3 (or of the database
+BOOKS_DB_PATH names) and never writes to the original. app is imported with
+BOOKS_DB_PATH pointing at a copy too, as importing it applies pending
+migrations and switches the database to WAL mode.
+
+    python bench.py pool [--requests 2000]
+    python bench.py indexes [--rows 1000000]
+    python bench.py concurrency [--readers 8] [--writers 2] [--seconds 5]
+    python bench.py writes [--writers 32] [--requests 2000]
+    python bench.py keyset [--rows 1000000] [--page 10000]
+    python bench.py memory [--rows 100000]
+    python bench.py asgi [--rows 100000] [--clients 256] [--requests 2000]
+    python bench.py generate [--rows 1000000] [--output catalog.sqlite3]
+    python bench.py suite [--sizes 1000,100000,1000000] [--themes bootstrap,bulma] [--samples 50]
+                          [--clients 8] [--json-out report.json]
+"""
+import argparse
+import asyncio
+import gc
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+
+def temp_db(source=None):
+    """Copy a database (by default the one app uses) to a temp dir and return the new path."""
+    tmp = tempfile.mkdtemp(prefix="books-bench-")
+    path = os.path.join(tmp, "db.sqlite3")
+    # The backup API also copies pages still in the WAL file
+    src, dst = sqlite3.connect(source or books.DB_PATH), sqlite3.connect(path)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    return path
+
+
+os.environ["BOOKS_DB_PATH"] = temp_db(os.environ.get("BOOKS_DB_PATH", "db.sqlite3"))
+import app as books  # noqa: E402  (after BOOKS_DB_PATH, as it migrates the database on import)
+
+
+def requests_per_sec(client, url, n):
+    client.get(url)  # warm up templates and the pool
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(url)
+    return n / (time.perf_counter() - start)
+
+
+# Compare connect-per-request (pool size 0) with the pooled connections
+def bench_pool(args):
+    path = temp_db()
+    book_id = books.sqlite3.connect(path).execute("SELECT MIN(id) FROM books").fetchone()[0]
+    urls = ["/", f"/view/{book_id}"]
+    client = books.app.test_client()
+
+    print(f"{'url':<12} {'no pool':>12} {'pooled':>12}")
+    for url in urls:
+        results = []
+        for size in (0, books.POOL_SIZE):
+            books.configure_db(path, size=size)
+            results.append(requests_per_sec(client, url, args.requests))
+        print(f"{url:<12} {results[0]:>10.0f}/s {results[1]:>10.0f}/s")
+
+
+# Shape of the synthetic catalog: summary lengths are log-normal around
+# SUMMARY_MEDIAN characters and books per category follow a Zipf curve, so a
+# few categories hold most of the books as in the real data.
+CATALOG_CATEGORIES = 20
+CATEGORY_SKEW = 1.1
+SUMMARY_MEDIAN = 400
+SUMMARY_SIGMA = 0.7
+SUMMARY_MAX = 8000
+WORDS = ("shadow", "garden", "river", "night", "spring", "sword", "letter", "moon", "island", "winter",
+         "academy", "dragon", "princess", "villain", "reincarnated", "guild", "magic", "sister", "king",
+         "tower", "journey", "summer", "promise", "demon", "hero", "forest", "city", "dream", "war", "sea")
+
+
+# Add `rows` synthetic books. The full-text triggers are dropped while loading
+# and the index is rebuilt once at the end, which is much faster than per row.
+def fill_books(path, rows, seed=42):
+    conn = books.sqlite3.connect(path)
+    names = {r[0] for r in conn.execute("SELECT name FROM categories")}
+    for n in range(1, CATALOG_CATEGORIES + 1):
+        if len(names) >= CATALOG_CATEGORIES:
+            break
+        if f"Genre {n}" not in names:
+            conn.execute("INSERT INTO categories (name) VALUES (?)", (f"Genre {n}",))
+            names.add(f"Genre {n}")
+    category_ids = [r[0] for r in conn.execute("SELECT id FROM categories ORDER BY id")]
+    weights = [1 / (rank + 1) ** CATEGORY_SKEW for rank in range(len(category_ids))]
+    for trigger in ("books_fts_insert", "books_fts_update", "books_fts_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    rng = random.Random(seed)
+    mu = math.log(SUMMARY_MEDIAN)
+
+    def summary():
+        length = min(int(rng.lognormvariate(mu, SUMMARY_SIGMA)), SUMMARY_MAX)
+        # Words average about 6 characters with the space
+        return " ".join(rng.choices(WORDS, k=length // 6 + 1)).capitalize() + "."
+
+    def generate():
+        for i, category_id in enumerate(rng.choices(category_ids, weights, k=rows)):
+            title = " ".join(rng.choices(WORDS, k=rng.randrange(2, 7))).title() + f" {i}"
+            yield (
+                title, title.lower(), f"Author {rng.randrange(rows // 20 + 1)}",
+                f"{rng.randrange(1950, 2025)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+                f"Vol. {rng.randrange(1, 30)}", f"https://example.com/{i}",
+                summary(), category_id,
+            )
+
+    conn.executemany("""
+        INSERT INTO books (title, hepburn, author, published_date, release, url, summary, category_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, generate())
+    conn.commit()
+    conn.close()
+    with books.app.app_context():
+        books.rebuild_search_index()
+
+
+# A database holding exactly `rows` synthetic books (the sample books are
+# removed), with the same schema, migrations and triggers as db.sqlite3
+def generate_catalog(rows, path=None, seed=42):
+    source = temp_db()
+    conn = books.sqlite3.connect(source)
+    conn.execute("DELETE FROM books")
+    conn.commit()
+    conn.close()
+    books.configure_db(source)
+    fill_books(source, rows, seed)
+    if path and path != source:
+        src, dst = books.sqlite3.connect(source), books.sqlite3.connect(path)
+        src.backup(dst)
+        src.close()
+        dst.close()
+        return path
+    return source
+
+
+# Write a synthetic catalog to --output, e.g. to run the app against it
+def bench_generate(args):
+    start = time.perf_counter()
+    path = generate_catalog(args.rows, args.output)
+    print(f"{args.rows} books written to {path} in {time.perf_counter() - start:.1f}s")
+
+
+# Query plans and timings of the list page queries, without and with BOOK_INDEXES
+def bench_indexes(args):
+    path = temp_db()
+    books.configure_db(path)
+    print(f"Generating {args.rows} books...")
+    fill_books(path, args.rows)
+
+    statements = []
+    queries = [(name, column) for column, (name, _) in enumerate(books.LIST_COLUMNS)]
+    with books.app.app_context():
+        conn, writer = books.get_db(), books.get_write_db()
+        timings = {}
+        for label in ("without", "with"):
+            if label == "without":
+                for name in books.BOOK_INDEXES:
+                    writer.execute(f"DROP INDEX IF EXISTS {name}")
+            else:
+                for name, column in books.BOOK_INDEXES.items():
+                    writer.execute(f"CREATE INDEX IF NOT EXISTS {name} ON books ({column})")
+                writer.execute("ANALYZE books")
+            writer.commit()
+            print(f"\n== {label} indexes ==")
+            for name, column in queries:
+                conn.set_trace_callback(statements.append)
+                books.get_books_page(0, 10, column, "asc")
+                conn.set_trace_callback(None)
+                page_sql = statements[-1]
+                # A fresh connection, so the plan is not a cached statement from before the DDL
+                explain = books.sqlite3.connect(path)
+                plan = [r[3] for r in explain.execute(f"EXPLAIN QUERY PLAN {page_sql}")]
+                explain.close()
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    books.get_books_page(0, 10, column, "asc")
+                timings[label, name] = (time.perf_counter() - start) / args.repeat * 1000
+                print(f"order by {name}: {'; '.join(plan)}")
+
+    print(f"\n{'order by':<16} {'without':>12} {'with':>12}")
+    for name, _ in queries:
+        print(f"{name:<16} {timings['without', name]:>10.2f}ms {timings['with', name]:>10.2f}ms")
+
+
+# Fields posted to /edit/<id> by the benchmark writers
+EDIT_FIELDS = ("title", "hepburn", "author", "published_date", "release", "url", "summary", "category_id")
+
+# Connection settings compared by the concurrency benchmark
+CONCURRENCY_CONFIGS = {
+    "rollback journal": {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 0},
+    "SQLITE_PRAGMAS": books.SQLITE_PRAGMAS,
+}
+
+
+# Readers on /view/<id> and /books.json while writers POST /edit/<id>, for each
+# set of PRAGMAs. The page cache is disabled so every read hits the database.
+def bench_concurrency(args):
+    books.page_cache = books.MemoryPageCache(max_entries=0)
+    books.app.logger.disabled = True  # failed requests are counted, not logged
+    print(f"{'config':<18} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+    for label, pragmas in CONCURRENCY_CONFIGS.items():
+        path = temp_db()
+        conn = books.sqlite3.connect(path)
+        conn.execute(f"PRAGMA journal_mode = {pragmas.get('journal_mode', 'DELETE')}")
+        ids = [r[0] for r in conn.execute("SELECT id FROM books")]
+        row = conn.execute(f"SELECT {', '.join(EDIT_FIELDS)} FROM books LIMIT 1").fetchone()
+        form = {k: "" if v is None else str(v) for k, v in zip(EDIT_FIELDS, row)}
+        conn.close()
+        books.configure_db(path, pragmas=pragmas)
+
+        counts = {"read": 0, "write": 0, "error": 0}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def worker(kind):
+            client = books.app.test_client()
+            rng = random.Random()
+            done = errors = 0
+            while not stop.is_set():
+                book_id = rng.choice(ids)
+                if kind == "write":
+                    response = client.post(f"/edit/{book_id}", data=form)
+                elif rng.random() < 0.5:
+                    response = client.get(f"/view/{book_id}")
+                else:
+                    response = client.get("/books.json?start=0&length=10")
+                if response.status_code < 400:
+                    done += 1
+                else:
+                    errors += 1
+            with lock:
+                counts[kind] += done
+                counts["error"] += errors
+
+        threads = [threading.Thread(target=worker, args=("read",)) for _ in range(args.readers)]
+        threads += [threading.Thread(target=worker, args=("write",)) for _ in range(args.writers)]
+        for t in threads:
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        print(f"{label:<18} {counts['read'] / args.seconds:>10.0f} "
+              f"{counts['write'] / args.seconds:>10.0f} {counts['error']:>8}")
+
+
+# Bursts of concurrent POST /edit requests, each writer committing on its own
+# versus the group-commit writer queue
+def bench_writes(args):
+    books.page_cache = books.MemoryPageCache(max_entries=0)
+    path = temp_db()
+    conn = books.sqlite3.connect(path)
+    ids = [r[0] for r in conn.execute("SELECT id FROM books")]
+    row = conn.execute(f"SELECT {', '.join(EDIT_FIELDS)} FROM books LIMIT 1").fetchone()
+    form = {k: "" if v is None else str(v) for k, v in zip(EDIT_FIELDS, row)}
+    conn.close()
+    books.configure_db(path, size=max(args.writers, books.POOL_SIZE))
+    per_thread = max(args.requests // args.writers, 1)
+
+    print(f"{'mode':<16} {'writes/s':>10} {'commits':>10}")
+    for label, group_commit in (("commit per write", False), ("group commit", True)):
+        books.GROUP_COMMIT = group_commit
+        commits_before = books.writer.commits
+        barrier = threading.Barrier(args.writers + 1)
+
+        def worker():
+            client = books.app.test_client()
+            rng = random.Random()
+            barrier.wait()
+            for _ in range(per_thread):
+                client.post(f"/edit/{rng.choice(ids)}", data=form)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.writers)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        total = per_thread * args.writers
+        commits = books.writer.commits - commits_before if group_commit else total
+        print(f"{label:<16} {total / elapsed:>10.0f} {commits:>10}")
+
+
+# Time to fetch list page 1 and page --page with OFFSET and with a keyset cursor,
+# for every sortable column
+def bench_keyset(args):
+    length = 10
+    path = temp_db()
+    books.configure_db(path)
+    print(f"Generating {args.rows} books...")
+    fill_books(path, args.rows)
+    start = (args.page - 1) * length
+
+    def timed(*page_args):
+        begin = time.perf_counter()
+        for _ in range(args.repeat):
+            result = books.get_books_page(*page_args)
+        return (time.perf_counter() - begin) / args.repeat * 1000, result[2]
+
+    print(f"{'order by':<16} {'page 1':>10} {'offset':>10} {'keyset':>10}   (page {args.page})")
+    with books.app.app_context():
+        for column, (name, _) in enumerate(books.LIST_COLUMNS):
+            first, _ = timed(0, length, column, "asc")
+            # The cursor comes from the last row of the page before
+            _, previous = timed(start - length, length, column, "asc")
+            after = (previous[-1][name], previous[-1]["id"])
+            offset, expected = timed(start, length, column, "asc")
+            keyset, rows = timed(start, length, column, "asc", "", after)
+            assert rows == expected
+            print(f"{name:<16} {first:>8.2f}ms {offset:>8.2f}ms {keyset:>8.2f}ms")
+
+
+# Memory and time to hold every book of a --rows catalog in a list: as dicts
+# copied from sqlite3.Row (what get_books returned before), as the sqlite3.Row
+# objects themselves, and as the Book tuples get_books returns now
+def bench_memory(args):
+    print(f"Generating {args.rows} books...")
+    books.configure_db(generate_catalog(args.rows))
+    sql = f"SELECT {books.book_columns_sql()} FROM books b LEFT JOIN categories c ON b.category_id = c.id ORDER BY b.id"
+
+    def as_dicts():
+        return [dict(r) for r in books.get_db().execute(sql).fetchall()]
+
+    def as_rows():
+        return books.get_db().execute(sql).fetchall()
+
+    variants = {"dict": as_dicts, "sqlite3.Row": as_rows, "Book (get_books)": books.get_books}
+    print(f"{'rows as':<18} {'bytes/row':>10} {'saved':>10} {'total':>10} {'peak':>10} {'time':>10}")
+    per_row = {}
+    with books.app.app_context():
+        books.get_books()  # warm up the pool, statement cache and Book type
+        for label, load in variants.items():
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            rows = load()
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            per_row[label] = current / len(rows)
+            saved = per_row["dict"] - per_row[label]
+            print(f"{label:<18} {per_row[label]:>10.0f} {saved:>10.0f} {current / 2**20:>8.1f}MB "
+                  f"{peak / 2**20:>8.1f}MB {elapsed * 1000:>8.0f}ms")
+            del rows
+
+
+# Routes timed by the suite, per theme. {id} is a random book and {q} a
+# random word. POST /edit re-saves a book's own values so the data is unchanged,
+# POST /add inserts a copy of one, and /delete/{spare} removes a copy inserted
+# just before the request (outside the timing). POST /set_theme picks the theme
+# being timed.
+SUITE_ROUTES = [
+    ("GET", "/"),
+    ("GET", "/books.json?draw=1&start=0&length=10&order[0][column]=1&order[0][dir]=asc"),
+    ("GET", "/search?q={q}"),
+    ("GET", "/view/{id}"),
+    ("GET", "/edit/{id}"),
+    ("POST", "/edit/{id}"),
+    ("GET", "/add"),
+    ("POST", "/add"),
+    ("GET", "/delete/{spare}"),
+    ("POST", "/set_theme"),
+]
+# Routes whose output does not depend on the theme, timed once per size
+SUITE_API_ROUTES = [
+    ("GET", "/api/search?q={q}"),
+    ("GET", "/api/books?limit=50"),
+    ("GET", "/api/books?limit=50&fields=id,title,author"),
+    ("GET", "/api/books/{id}"),
+    ("GET", "/api/categories"),
+    ("GET", "/export/books.csv"),
+    ("GET", "/export/books.jsonl"),
+    ("GET", "/export/books.json"),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Insert a copy of a book to be deleted by a benchmarked request; returns its id
+def spare_book(path, book_id):
+    conn = sqlite3.connect(path)
+    with conn:
+        cur = conn.execute(f"INSERT INTO books ({', '.join(EDIT_FIELDS)}) "
+                           f"SELECT {', '.join(EDIT_FIELDS)} FROM books WHERE id = ?", (book_id,))
+    conn.close()
+    return cur.lastrowid
+
+
+# The requests of one route: (method, url, form) with fresh ids and words.
+# A {spare} book is inserted as its request is generated.
+def route_requests(method, url, n, ids, forms, rng, path, theme):
+    for _ in range(n):
+        book_id = rng.choice(ids)
+        spare = spare_book(path, book_id) if "{spare}" in url else None
+        form = None
+        if method == "POST":
+            form = {"theme": theme} if url == "/set_theme" else forms[book_id]
+        yield method, url.format(id=book_id, q=rng.choice(WORDS), spare=spare), form
+
+
+# Time `samples` requests of a route in-process, one after another
+def drive_test_client(client, requests):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for method, path, form in requests:
+        begin = time.perf_counter()
+        response = client.open(path, method=method, data=form)
+        response.get_data()  # drain streamed responses
+        latencies.append(time.perf_counter() - begin)
+        errors += response.status_code >= 400
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+# Time requests of a route over HTTP from `clients` threads at once
+def drive_wsgi(port, cookie, requests, clients):
+    work = list(requests)
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        mine, failed = [], 0
+        for method, path, form in chunk:
+            headers = {"Cookie": cookie} if cookie else {}
+            body = None
+            if form is not None:
+                body = urlencode(form)
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            begin = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            mine.append(time.perf_counter() - begin)
+            failed += response.status >= 400
+            if response.will_close:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(work[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+# Session cookie selecting `theme`, as a browser would get it from the theme picker
+def theme_cookie(port, theme):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("POST", "/set_theme", body=urlencode({"theme": theme}),
+                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    cookie = response.getheader("Set-Cookie", "")
+    return cookie.split(";", 1)[0]
+
+
+# Every route, for every theme, at every catalog size: through the Flask test
+# client and through a threaded WSGI server. Prints a JSON report.
+def bench_suite(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    themes = args.themes.split(",") if args.themes else books.AVAILABLE_TEMPLATES
+    if not args.page_cache:
+        books.page_cache = books.MemoryPageCache(max_entries=0)
+    books.app.logger.disabled = True  # failed requests are counted, not logged
+    logging.getLogger("werkzeug").disabled = True
+    report = {"commit": git_commit(), "python": sys.version.split()[0], "samples": args.samples,
+              "clients": args.clients, "page_cache": args.page_cache, "sizes": {}}
+
+    for rows in sizes:
+        print(f"Generating {rows} books...", file=sys.stderr)
+        start = time.perf_counter()
+        path = generate_catalog(rows)
+        result = report["sizes"][str(rows)] = {"generate_seconds": round(time.perf_counter() - start, 1)}
+        books.configure_db(path)
+        books.invalidate_categories()
+        books.page_cache.clear()
+        conn = books.sqlite3.connect(path)
+        result["db_mb"] = round(os.path.getsize(path) / 2**20, 1)
+        result["avg_summary_chars"] = round(conn.execute("SELECT AVG(LENGTH(summary)) FROM books").fetchone()[0])
+        ids = [r[0] for r in conn.execute("SELECT id FROM books ORDER BY RANDOM() LIMIT 1000")]
+        forms = {}
+        for row in conn.execute(f"SELECT id, {', '.join(EDIT_FIELDS)} FROM books WHERE id IN "
+                                f"({', '.join('?' * len(ids))})", ids):
+            forms[row[0]] = {k: "" if v is None else str(v) for k, v in zip(EDIT_FIELDS, row[1:])}
+        conn.close()
+        rng = random.Random(args.seed)
+
+        server = make_server("127.0.0.1", 0, books.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+        try:
+            for driver in ("test_client", "wsgi"):
+                timings = result[driver] = {}
+                for theme in themes + [None]:
+                    routes = SUITE_ROUTES if theme else SUITE_API_ROUTES
+                    label = theme or "api"
+                    print(f"  {rows} {driver} {label}", file=sys.stderr)
+                    timings[label] = {}
+                    if driver == "test_client":
+                        client = books.app.test_client()
+                        if theme:
+                            with client.session_transaction() as session:
+                                session["theme"] = theme
+                    else:
+                        cookie = theme_cookie(port, theme) if theme else None
+                    for method, url in routes:
+                        for samples in (1, args.samples):  # the first pass warms up templates and pools
+                            requests = route_requests(method, url, samples, ids, forms, rng, path, theme)
+                            if driver == "test_client":
+                                stats = drive_test_client(client, requests)
+                            else:
+                                stats = drive_wsgi(port, cookie, requests, args.clients)
+                        timings[label][f"{method} {url}"] = stats
+        finally:
+            server.shutdown()
+            server.server_close()
+        # ru_maxrss is the high-water mark of the whole run so far
+        result["peak_rss_mb"] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            f.write(output + "\n")
+        print(f"Report written to {args.json_out}", file=sys.stderr)
+    else:
+        print(output)
+
+
+# Routes compared by the asgi benchmark: coroutine views, and a page the
+# ASGI app hands to Flask
+ASGI_ROUTES = ["/api/books/{id}", "/api/books?limit=50&fields=id,title,author", "/view/{id}"]
+
+
+# The same requests from --clients concurrent callers: threads calling the
+# WSGI app, and tasks on one event loop awaiting the ASGI app. Both run in
+# this process, so the numbers compare the apps rather than HTTP servers.
+def bench_asgi(args):
+    import asgi  # imported here so the other benchmarks run without it
+
+    print(f"Generating {args.rows} books...")
+    books.configure_db(generate_catalog(args.rows))
+    books.page_cache = books.MemoryPageCache(max_entries=0)
+    books.app.logger.disabled = True  # failed requests are counted, not logged
+    with books.app.app_context():
+        ids = [r[0] for r in books.get_db().execute("SELECT id FROM books ORDER BY RANDOM() LIMIT 1000")]
+    rng = random.Random(args.seed)
+
+    def urls(route):
+        return [route.format(id=rng.choice(ids)) for _ in range(args.requests)]
+
+    def run_wsgi(route):
+        work = urls(route)
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def worker(chunk):
+            mine, failed = [], 0
+            for url in chunk:
+                begin = time.perf_counter()
+                response = Response.from_app(books.app, EnvironBuilder(url).get_environ(), True)
+                mine.append(time.perf_counter() - begin)
+                failed += response.status_code >= 400
+            with lock:
+                latencies.extend(mine)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=worker, args=(work[i::args.clients],)) for i in range(args.clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return summarize(latencies, time.perf_counter() - start, errors[0])
+
+    async def call_asgi(url):
+        path, _, query = url.partition("?")
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+                 "headers": [], "http_version": "1.1", "scheme": "http", "root_path": ""}
+        messages = [{"type": "http.request", "body": b""}]
+        status = []
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await asgi.application(scope, receive, send)
+        return status[0]
+
+    async def run_asgi(route):
+        work = urls(route)
+        latencies, errors = [], 0
+
+        async def worker(chunk):
+            nonlocal errors
+            for url in chunk:
+                begin = time.perf_counter()
+                status = await call_asgi(url)
+                latencies.append(time.perf_counter() - begin)
+                errors += status >= 400
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(work[i::args.clients]) for i in range(args.clients)))
+        return summarize(latencies, time.perf_counter() - start, errors)
+
+    print(f"{args.clients} concurrent clients, {args.requests} requests per route")
+    print(f"{'route':<44} {'app':<5} {'req/s':>8} {'p50':>9} {'p99':>9} {'errors':>7}")
+    for route in ASGI_ROUTES:
+        for label, run in (("wsgi", run_wsgi), ("asgi", lambda r: asyncio.run(run_asgi(r)))):
+            run(route)  # warm up
+            stats = run(route)
+            print(f"{route:<44} {label:<5} {stats['requests_per_sec']:>8.0f} {stats['p50_ms']:>7.2f}ms "
+                  f"{stats['p99_ms']:>7.2f}ms {stats['errors']:>7}")
+
+
+BENCHMARKS = {
+    "pool": bench_pool,
+    "indexes": bench_indexes,
+    "concurrency": bench_concurrency,
+    "writes": bench_writes,
+    "keyset": bench_keyset,
+    "memory": bench_memory,
+    "asgi": bench_asgi,
+    "generate": bench_generate,
+    "suite": bench_suite,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=None)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--page", type=int, default=10000)
+    parser.add_argument("--output", default="catalog.sqlite3")
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--themes", default=None, help="comma-separated; default all AVAILABLE_TEMPLATES")
+    parser.add_argument("--samples", type=int, default=50, help="requests per route and theme")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent HTTP clients against the WSGI server")
+    parser.add_argument("--page-cache", action="store_true", help="keep the rendered-page cache on")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json-out", default=None)
+    args = parser.parse_args()
+    if args.benchmark in ("memory", "asgi") and "--rows" not in sys.argv:
+        args.rows = 100_000
+    if args.benchmark == "asgi" and "--clients" not in sys.argv:
+        args.clients = 256
+    if args.writers is None:
+        args.writers = 32 if args.benchmark == "writes" else 2
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,17 @@
+"""
+Shared test setup: every test runs against a temporary copy of db.sqlite3.
+
+app.py applies its migrations to DB_PATH when it is imported, so BOOKS_DB_PATH
+is pointed at the copy here, before any test module imports app.
+"""
+import os
+import sqlite3
+import tempfile
+
+SAMPLE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.sqlite3")
+TEST_DB = os.path.join(tempfile.mkdtemp(prefix="books-test-"), "db.sqlite3")
+_src, _dst = sqlite3.connect(SAMPLE_DB), sqlite3.connect(TEST_DB)
+_src.backup(_dst)
+_src.close()
+_dst.close()
+os.environ["BOOKS_DB_PATH"] = TEST_DB
@@ -0,0 +1,69 @@
+"""
+JSON API responses.
+
+    python -m pytest -q test_api.py
+"""
+import pytest
+
+import app as books
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(books, "page_cache", books.MemoryPageCache(max_entries=0))
+    return books.app.test_client()
+
+
+@pytest.fixture
+def book_id(client):
+    return client.get("/api/books?limit=1&fields=id").json["data"][0]["id"]
+
+
+# Book rows are namedtuples, which cannot hold a name twice
+@pytest.mark.parametrize("fields", ["title,title", "id,id", "id,title,id"])
+def test_repeated_fields_are_listed_once(client, book_id, fields):
+    expected = list(dict.fromkeys(fields.split(",")))
+    response = client.get(f"/api/books?limit=2&fields={fields}")
+    assert response.status_code == 200
+    assert [list(book) for book in response.json["data"]] == [expected] * 2
+    response = client.get(f"/api/books/{book_id}?fields={fields}")
+    assert response.status_code == 200
+    assert list(response.json) == expected
+
+
+@pytest.fixture
+def book(client, book_id):
+    fields = ",".join(books.BOOK_WRITABLE)
+    return client.get(f"/api/books/{book_id}?fields={fields}").json
+
+
+@pytest.mark.parametrize("change", [
+    {"category_id": "abc"},
+    {"category_id": 1.5},
+    {"category_id": True},
+    {"category_id": 2**62},  # no such category
+    {"title": 42},
+    {"title": ["a"]},
+])
+def test_invalid_values_are_rejected(client, book_id, book, change):
+    assert client.post("/api/books", json={**book, **change}).status_code == 400
+    assert client.put(f"/api/books/{book_id}", json={**book, **change}).status_code == 400
+    assert client.patch(f"/api/books/{book_id}", json=change).status_code == 400
+    assert client.get(f"/api/books/{book_id}?fields={','.join(book)}").json == book
+
+
+def test_create_with_existing_category(client, book):
+    response = client.post("/api/books", json=book)
+    assert response.status_code == 201
+    assert response.json["category_id"] == book["category_id"]
+    assert response.json["category_name"] is not None
+    assert client.delete(response.headers["Location"]).status_code == 204
+
+
+@pytest.mark.parametrize("category_id", ["1e999", "1.5", "true", '"1x"', '"²"', "[1]"])
+def test_bulk_import_rejects_bad_category_id(client, category_id):
+    body = '{"title": "a", "category_id": %s}\n' % category_id
+    response = client.post("/api/books/bulk?format=jsonl", data=body)
+    assert response.status_code == 200
+    assert response.json["imported"] == 0
+    assert response.json["errors"] == [{"record": 1, "message": "category_id must be an integer"}]
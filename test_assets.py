@@ -0,0 +1,52 @@
+"""
+Building the self-hosted assets, with downloads faked.
+
+    python -m pytest -q test_assets.py
+"""
+import json
+
+import pytest
+
+import app as books
+
+FILES = {
+    "https://cdn.example/lib.js": b"console.log(1)",
+    "https://cdn.example/css/lib.css": b"@font-face{src:url(../fonts/f.woff)}",
+    "https://cdn.example/fonts/f.woff": b"font",
+}
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    files = dict(FILES)
+    monkeypatch.setattr(books, "ASSETS", {"lib.js": "https://cdn.example/lib.js",
+                                          "lib.css": "https://cdn.example/css/lib.css"})
+    monkeypatch.setattr(books, "ASSET_DIR", str(tmp_path / "assets"))
+    monkeypatch.setattr(books, "ASSET_MANIFEST", str(tmp_path / "assets" / "manifest.json"))
+    monkeypatch.setattr(books, "ASSET_PINS", str(tmp_path / "asset-pins.json"))
+    monkeypatch.setattr(books, "asset_manifest", {})
+    monkeypatch.setattr(books, "fetch", files.__getitem__)
+    runner = books.app.test_cli_runner()
+
+    def run(*args):
+        return runner.invoke(args=["assets", "build", *args])
+    run.files = files
+    return run
+
+
+def test_unpinned_download_fails(build):
+    result = build()
+    assert result.exit_code != 0
+    assert "no pinned sha256" in result.output
+
+
+def test_pins_are_recorded_then_enforced(build):
+    assert build("--update-pins").exit_code == 0
+    with open(books.ASSET_PINS) as f:
+        assert sorted(json.load(f)) == sorted(FILES)
+    assert build().exit_code == 0
+
+    build.files["https://cdn.example/fonts/f.woff"] = b"other font"
+    result = build()
+    assert result.exit_code != 0
+    assert "https://cdn.example/fonts/f.woff has sha256" in result.output
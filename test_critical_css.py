@@ -0,0 +1,24 @@
+"""
+Critical CSS extraction.
+
+    python -m pytest -q test_critical_css.py
+"""
+import app as books
+
+VOCABULARY = ({"a", "body", "p"}, {"btn"}, set())
+
+
+def test_brace_in_quoted_selector_keeps_following_rules():
+    css = (
+        'a[href^="{"]{color:red}'
+        '@media (min-width:40em){body{margin:0}}'
+        '@font-face{font-family:x;src:url("x.woff")}'
+        'body{color:#000}'
+        '.btn{padding:1px}'
+    )
+    assert books.critical_rules(css, VOCABULARY) == css
+
+
+def test_escaped_brace_and_quoted_semicolon():
+    css = '@import url("a;b.css");.btn\\{x{color:red}p{content:";}"}.unused{color:blue}'
+    assert books.critical_rules(css, VOCABULARY) == 'p{content:";}"}'
@@ -0,0 +1,157 @@
+"""
+SQL statements issued per request by the page and form routes.
+
+    python -m pytest -q test_queries.py
+
+Runs against the temporary copy of db.sqlite3 made by conftest.py, with every
+pooled connection traced by set_trace_callback.
+"""
+import sqlite3
+
+import pytest
+
+import app as books
+
+TEST_DB = books.DB_PATH
+
+# Transaction control around a write, which is not a query of its own
+TRANSACTION = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+
+# Statements a request issued itself: not transaction control, trigger programs
+# ("-- ..."), or FTS5's own statements on its shadow tables ('main'.'books_fts_...').
+# SQLite traces a statement again each time a nested one returns to it, so
+# repeats are counted once.
+def own_statements(statements):
+    return list(dict.fromkeys(
+        s for s in statements
+        if not s.startswith("--") and "'main'." not in s
+        and not s.lstrip().upper().startswith(TRANSACTION)
+    ))
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    statements = []
+    connect = books.ConnectionPool._connect
+
+    def traced_connect(pool):
+        entry = connect(pool)
+        entry[0].set_trace_callback(statements.append)
+        return entry
+
+    monkeypatch.setattr(books.ConnectionPool, "_connect", traced_connect)
+    monkeypatch.setattr(books, "page_cache", books.MemoryPageCache(max_entries=0))
+    books.configure_db(TEST_DB)  # new pools, so every connection is traced
+    books.invalidate_categories()
+    client = books.app.test_client()
+    client.get("/add")  # fill the category cache, as any earlier request would
+
+    def queries(method, url, **kwargs):
+        statements.clear()
+        response = getattr(client, method)(url, **kwargs)
+        response.get_data()  # a streamed page queries as its body is read
+        assert response.status_code < 400
+        return own_statements(statements)
+
+    yield queries
+    books.configure_db(TEST_DB)
+
+
+@pytest.fixture
+def book_id():
+    return sqlite3.connect(TEST_DB).execute("SELECT MIN(id) FROM books").fetchone()[0]
+
+
+# A row for a test to delete
+@pytest.fixture
+def spare_book_id(book_id):
+    conn = sqlite3.connect(TEST_DB)
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO books (title, hepburn, author, published_date, release, url, summary, category_id) "
+            "SELECT 'Spare', hepburn, author, published_date, release, url, summary, category_id "
+            "FROM books WHERE id = ?", (book_id,))
+    conn.close()
+    return cur.lastrowid
+
+
+def is_data_version(statement):
+    return "FROM app_meta" in statement
+
+
+@pytest.fixture
+def form(book_id):
+    with books.app.app_context():
+        book = books.get_book(book_id, books.BOOK_WRITABLE)
+    return {k: "" if v is None else str(v) for k, v in book.items()}
+
+
+def test_get_edit_reads_book_once(traced, book_id):
+    statements = traced("get", f"/edit/{book_id}")
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith("SELECT")
+
+
+def test_get_add_uses_category_cache(traced):
+    assert traced("get", "/add") == []
+
+
+def test_post_edit_only_writes(traced, book_id, form):
+    statements = traced("post", f"/edit/{book_id}", data=form)
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith("UPDATE")
+
+
+def test_post_add_only_writes(traced, form):
+    statements = traced("post", "/add", data=form)
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith("INSERT")
+
+
+# The write runs on the group-commit thread but counts toward the request
+def test_post_edit_reports_its_write(book_id, form):
+    response = books.app.test_client().post(f"/edit/{book_id}", data=form)
+    assert 'desc="1 queries"' in response.headers["Server-Timing"]
+
+
+# Server-side lists load their rows from /books.json; the page only checks the data version
+@pytest.mark.parametrize("server_side, stream, expected", [
+    (True, False, 1),
+    (False, False, 2),
+    (False, True, 2),
+])
+def test_index(traced, monkeypatch, server_side, stream, expected):
+    monkeypatch.setattr(books, "SERVER_SIDE_LIST", server_side)
+    monkeypatch.setattr(books, "STREAM_LIST", stream)
+    statements = traced("get", "/")
+    assert len(statements) == expected
+    assert is_data_version(statements[0])
+
+
+def test_get_view_reads_book_once(traced, book_id):
+    statements = traced("get", f"/view/{book_id}")
+    assert len(statements) == 2
+    assert is_data_version(statements[0])
+    assert statements[1].lstrip().upper().startswith("SELECT")
+
+
+# A client with the current page only costs the data-version read
+def test_revalidation_reads_data_version(traced, book_id):
+    for url in ("/", f"/view/{book_id}"):
+        client = books.app.test_client()
+        etag = client.get(url).headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        statements = traced("get", url, headers={"If-None-Match": etag})
+        assert len(statements) == 1
+        assert is_data_version(statements[0])
+
+
+def test_delete_only_writes(traced, spare_book_id):
+    statements = traced("get", f"/delete/{spare_book_id}")
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith("DELETE")
+
+
+def test_set_theme_runs_no_queries(traced):
+    assert traced("post", "/set_theme", data={"theme": books.AVAILABLE_TEMPLATES[0]}) == []